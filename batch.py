@@ -0,0 +1,201 @@
+# Plays lots of headless, seeded games of Blueberry Dragon across a pool of processes,
+# with the player steered by a policy instead of the keyboard, and sums up how they went.
+# Handy for tuning the constants at the top of blueberry_dragon.py without playing
+# thousands of games by hand:
+#
+#   python batch.py --games 2000 --policy greedy --set NUM_DRAGONS=50 --out results.jsonl
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import blueberry_dragon as bd
+
+MAXSTEPS = 5000                           # give up on a game after this many simulation steps
+GAMESPERTASK = 8                          # games a worker plays before sending its results back
+
+
+class RandomWalkPolicy:
+    """Holds a random direction (or stands still) for a random number of steps."""
+
+    DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1), (0, 0))
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.steps_left = 0
+        self.keys = (False, False, False, False)
+
+    def __call__(self, game):
+        if self.steps_left == 0:
+            dx, dy = self.random.choice(self.DIRECTIONS)
+            self.keys = (dx < 0, dx > 0, dy < 0, dy > 0)
+            self.steps_left = self.random.randint(5, 30)
+
+        self.steps_left -= 1
+        return self.keys
+
+
+class GreedyPolicy:
+    """Heads for the closest dragon the player can eat, and runs away from any dragon
+    that could eat it once that dragon is within danger_radius pixels."""
+
+    def __init__(self, seed, danger_radius=150):
+        self.danger_radius = danger_radius
+
+    def __call__(self, game):
+        player = game.player_obj
+        half_size = player.size / 2.0
+        player_x = player.x + half_size
+        player_y = player.y + half_size
+        player_area = player.size ** 2
+
+        closest_meal = None
+        closest_threat = None
+        for d_obj in game.dragon_objs:
+            dx = d_obj.x + d_obj.width / 2.0 - player_x
+            dy = d_obj.y + d_obj.height / 2.0 - player_y
+            distance = dx * dx + dy * dy
+
+            if d_obj.width * d_obj.height <= player_area:
+                if closest_meal is None or distance < closest_meal[0]:
+                    closest_meal = (distance, dx, dy)
+            elif distance < self.danger_radius ** 2:
+                if closest_threat is None or distance < closest_threat[0]:
+                    closest_threat = (distance, dx, dy)
+
+        if closest_threat is not None:
+            distance, dx, dy = closest_threat
+            dx, dy = -dx, -dy
+        elif closest_meal is not None:
+            distance, dx, dy = closest_meal
+        else:
+            return False, False, False, False
+
+        # don't wiggle back and forth over a target that's already lined up
+        dead_zone = game.MOVERATE
+        return dx < -dead_zone, dx > dead_zone, dy < -dead_zone, dy > dead_zone
+
+
+POLICIES = {
+    'random-walk': RandomWalkPolicy,
+    'greedy': GreedyPolicy}
+
+
+def play_game(seed, policy_name='greedy', config=None, max_steps=MAXSTEPS):
+    # Plays one game until the player wins, dies or runs out of steps, and returns
+    # a record of how it went. init_resources(headless=True) has to have been called.
+    # Every core already runs a game of its own, so sprites aren't scaled on extra threads.
+    game = bd.BDGame(seed=seed, render=False, config=config, spawn_workers=0)
+    policy = POLICIES[policy_name](seed)
+
+    while game.step_count < max_steps and not (game.win_mode or game.game_over_mode):
+        game.set_input(*policy(game))
+        game.run_frame()
+
+    if game.win_mode:
+        outcome = 'win'
+    elif game.game_over_mode:
+        outcome = 'death'
+    else:
+        outcome = 'timeout'
+
+    return {
+        'seed': seed,
+        'outcome': outcome,
+        'steps': game.step_count,
+        'size': game.player_obj.size,
+        'meals': game.meals,
+        'hits': game.hits}
+
+
+_worker_ready = False  # set once a worker process has called init_resources()
+
+
+def _play_games(seeds, policy_name, config, max_steps):
+    # ProcessPoolExecutor only takes an initializer from Python 3.7 on, so each worker
+    # loads the sprites the first time it's handed some games
+    global _worker_ready
+    if not _worker_ready:
+        bd.init_resources(headless=True)
+        _worker_ready = True
+    return [play_game(seed, policy_name, config, max_steps) for seed in seeds]
+
+
+def summarize(records):
+    # Returns outcome rates and averages over a list of play_game() records.
+    summary = {'games': len(records)}
+    for outcome in ('win', 'death', 'timeout'):
+        steps = [record['steps'] for record in records if record['outcome'] == outcome]
+        summary[outcome + '_rate'] = len(steps) / float(len(records))
+        if steps and outcome != 'timeout':
+            summary['mean_steps_to_' + outcome] = statistics.mean(steps)
+            summary['median_steps_to_' + outcome] = statistics.median(steps)
+
+    for key in ('size', 'meals', 'hits'):
+        summary['mean_' + key] = statistics.mean(record[key] for record in records)
+    return summary
+
+
+def run_batch(games, policy_name='greedy', config=None, max_steps=MAXSTEPS, seed=0, workers=None,
+              out=None):
+    # Plays games with seeds seed .. seed + games - 1 across `workers` processes. Records
+    # are written to the file object `out` as JSON lines as soon as they come back.
+    # Returns the summary of all of them.
+    seeds = list(range(seed, seed + games))
+    tasks = [seeds[i:i + GAMESPERTASK] for i in range(0, len(seeds), GAMESPERTASK)]
+    workers = workers or os.cpu_count()
+
+    records = []
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_play_games, task, policy_name, config, max_steps) for task in tasks]
+        for future in as_completed(futures):
+            for record in future.result():
+                records.append(record)
+                if out is not None:
+                    out.write(json.dumps(record) + '\n')
+    elapsed = time.perf_counter() - start_time
+
+    summary = summarize(records)
+    summary['workers'] = workers
+    summary['seconds'] = elapsed
+    summary['games_per_second'] = games / elapsed
+    summary['steps_per_second'] = sum(record['steps'] for record in records) / elapsed
+    return summary
+
+
+def _parse_setting(text):
+    name, value = text.split('=', 1)
+    return name, json.loads(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play many headless games of Blueberry Dragon in parallel')
+    parser.add_argument('--games', type=int, default=1000, help='how many games to play')
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='greedy', help='who steers the player')
+    parser.add_argument('--set', type=_parse_setting, action='append', default=[], metavar='NAME=VALUE',
+                        help='override one of the BDGame tunables, e.g. NUM_DRAGONS=50 (can be repeated)')
+    parser.add_argument('--max-steps', type=int, default=MAXSTEPS, help='give up on a game after this many steps')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    parser.add_argument('--workers', type=int, help='processes to use (default: one per core)')
+    parser.add_argument('--out', help='write one JSON record per game to this file')
+    args = parser.parse_args()
+
+    out = open(args.out, 'w') if args.out else None
+    try:
+        summary = run_batch(args.games, args.policy, dict(args.set), args.max_steps, args.seed, args.workers, out)
+    finally:
+        if out is not None:
+            out.close()
+
+    for key, value in summary.items():
+        print('%-24s %s' % (key, round(value, 3) if isinstance(value, float) else value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Compares keeping enemy dragons as dicts, the way Blueberry Dragon used to, with the
+# Dragon objects (with __slots__) it uses now: bytes of memory per dragon, and the time
+# one simulation step's attribute reads and writes take:
+#
+#   python bench_entities.py --dragons 10000
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import blueberry_dragon as bd
+
+PASSES = 30                               # steps timed per kind of dragon
+
+
+def move_dragon_dicts(dragons):
+    # one step of BDGame._move_dragon_objs, the way it was written when every dragon was a dict
+    for d_obj in dragons:
+        d_obj['prevx'] = d_obj['x']
+        d_obj['prevy'] = d_obj['y']
+        d_obj['x'] += d_obj['movex']
+        d_obj['y'] += d_obj['movey']
+        d_obj['bounce'] += 1
+        if d_obj['bounce'] > d_obj['bouncerate']:
+            d_obj['bounce'] = 0
+
+
+def move_dragon_slots(dragons):
+    # the same step over Dragon objects
+    for d_obj in dragons:
+        d_obj.prevx = d_obj.x
+        d_obj.prevy = d_obj.y
+        d_obj.x += d_obj.movex
+        d_obj.y += d_obj.movey
+        d_obj.bounce += 1
+        if d_obj.bounce > d_obj.bouncerate:
+            d_obj.bounce = 0
+
+
+def run(count=10000, seed=0, passes=PASSES):
+    # Makes `count` dragons in a game, copies them both ways and measures each.
+    # Returns the measurements.
+    bd.init_resources(headless=True)
+    game = bd.BDGame(dragon_backend='objects', seed=seed, render=False, config={'NUM_DRAGONS': count})
+    game.run_frame()
+    game.spawn_queue.close()
+    fields = bd.Dragon.__slots__
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    dict_dragons = [{field: getattr(d_obj, field) for field in fields} for d_obj in game.dragon_objs]
+    dict_bytes = tracemalloc.get_traced_memory()[0] - before
+
+    before = tracemalloc.get_traced_memory()[0]
+    slot_dragons = [bd.Dragon(d_obj.x, d_obj.y, d_obj.width, d_obj.height, d_obj.movex, d_obj.movey,
+                              d_obj.surface, d_obj.bouncerate, d_obj.bounceheight) for d_obj in game.dragon_objs]
+    slot_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    start_time = time.perf_counter()
+    for i in range(passes):
+        move_dragon_dicts(dict_dragons)
+    dict_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for i in range(passes):
+        move_dragon_slots(slot_dragons)
+    slot_time = time.perf_counter() - start_time
+
+    return {
+        'dragons': len(slot_dragons),
+        'dict_bytes_each': dict_bytes / float(len(dict_dragons)),
+        'slots_bytes_each': slot_bytes / float(len(slot_dragons)),
+        'dict_step_ms': dict_time / passes * 1000,
+        'slots_step_ms': slot_time / passes * 1000,
+        'step_speedup': dict_time / slot_time}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the memory and attribute access time of dict and '
+                                                 'Dragon objects')
+    parser.add_argument('--dragons', type=int, default=10000, help='how many dragons to compare')
+    parser.add_argument('--passes', type=int, default=PASSES, help='steps timed per kind of dragon')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args.dragons, args.seed, args.passes)
+    for key, value in results.items():
+        print('%-16s %s' % (key, round(value, 3) if isinstance(value, float) else value))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
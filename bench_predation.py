@@ -0,0 +1,168 @@
+# Measures whole frames of ECOSYSTEM mode, where dragons eat each other, as the number of
+# dragons grows. The window (and with it the active area dragons live in) grows with the
+# count, so there are always DENSITY dragons to a 640x480 of it: the dragons are as
+# crowded, and get eaten as often, at every count, and what grows is the work of finding
+# the ones that touch. Each count is played headless in its own process, since the window
+# size is a module constant of the game, with the stage profiler on and the player standing
+# still, so the frames are the dragons' own. Alongside the frame time it reports the
+# predation stage (the sweep and prune plus the eating), both per dragon, how many dragons
+# get eaten per frame, and (up to --all-pairs-max dragons) how long checking every pair of
+# the same dragons would have taken instead of the sweep:
+#
+#   python bench_predation.py --dragons 500,1000,2000,4000,8000 --out predation.json
+#
+# If the sweep keeps up, the time per dragon stays about the same as the count grows.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+FRAMES = 100                              # frames timed per dragon count
+WARMUPFRAMES = 30                         # frames played before timing, while the first dragons spawn
+ALLPAIRSMAX = 2000                        # most dragons to time the all-pairs check with
+DENSITY = 100                             # dragons to every 640x480 of window
+
+
+def get_all_pairs(rects):
+    # the O(n^2) way: check every (x, y, width, height) against every one after it
+    pairs = []
+    for i, (x, y, width, height) in enumerate(rects):
+        right = x + width
+        bottom = y + height
+        for j in range(i + 1, len(rects)):
+            other_x, other_y, other_width, other_height = rects[j]
+            if other_x < right and other_x + other_width > x and other_y < bottom and other_y + other_height > y:
+                pairs.append((i, j))
+    return pairs
+
+
+def get_window(count, density=DENSITY):
+    # Returns the (width, height) of a 4:3 window with `density` dragons to each 640x480 of it
+    scale = (count / float(density)) ** 0.5
+    return int(640 * scale), int(480 * scale)
+
+
+def run_count(count, frames=FRAMES, seed=0, backend='objects', render=True, all_pairs_max=ALLPAIRSMAX,
+              density=DENSITY):
+    # Plays `frames` frames of an ECOSYSTEM game with `count` dragons in this process and
+    # returns their timings. The window size is a module constant of the game, so this
+    # should be the only count the process runs.
+    import blueberry_dragon as bd
+
+    width, height = get_window(count, density)
+    bd.WINWIDTH, bd.WINHEIGHT = width, height
+    bd.HALF_WINWIDTH, bd.HALF_WINHEIGHT = width // 2, height // 2
+    bd.init_resources(headless=True)
+
+    profiler = bd.FrameProfiler(capacity=frames)
+    game = bd.BDGame(dragon_backend=backend, seed=seed, render=render, profiler=profiler, spawn_workers=0,
+                     config={'NUM_DRAGONS': count, 'ECOSYSTEM': True})
+
+    all_pairs_time = 0.0
+    meals = 0
+    start_time = time.perf_counter()
+    for frame in range(WARMUPFRAMES + frames):
+        if frame == WARMUPFRAMES:
+            meals = game.dragon_meals
+            start_time = time.perf_counter()
+
+        game.run_frame()
+
+        # in a crowd the player eats its way far past WINSIZE, to sprites many times the size
+        # of the window, so it's held at its starting size
+        player = game.player_obj
+        if player.size != game.STARTSIZE:
+            player.size = game.STARTSIZE
+            player.surface = bd.DRAGON_SPRITES.get(player.facing, game.STARTSIZE, game.STARTSIZE)
+
+        if frame >= WARMUPFRAMES and count <= all_pairs_max:
+            # copied out first, so both backends are timed on the same plain tuples
+            pairs_start = time.perf_counter()
+            rects = [(d_obj.x, d_obj.y, d_obj.width, d_obj.height) for d_obj in game.dragon_objs]
+            check_start = time.perf_counter()
+            get_all_pairs(rects)
+            all_pairs_time += time.perf_counter() - check_start
+            start_time += time.perf_counter() - pairs_start
+    total_time = time.perf_counter() - start_time
+    game.spawn_queue.close()
+
+    stages = profiler.get_summary()
+    result = {
+        'dragons': count,
+        'window': '%sx%s' % (width, height),
+        'backend': backend,
+        'frames': frames,
+        'fps': frames / total_time,
+        'frame_ms': stages['frame'][0],
+        'frame_p99_ms': stages['frame'][1],
+        'frame_us_per_dragon': stages['frame'][0] * 1000 / count,
+        'predation_ms': stages['predation'][0],
+        'predation_us_per_dragon': stages['predation'][0] * 1000 / count,
+        'meals_per_frame': (game.dragon_meals - meals) / float(frames)}
+    if all_pairs_time:
+        result['all_pairs_ms'] = all_pairs_time / frames * 1000
+    return result
+
+
+def run_suite(counts, frames=FRAMES, seed=0, backend='objects', render=True, all_pairs_max=ALLPAIRSMAX,
+              density=DENSITY):
+    # Runs every count in a fresh process, printing a line for each as it finishes
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    print('%7s %11s %9s %11s %9s %12s %14s %7s %12s' % (
+        'dragons', 'window', 'frame ms', 'us/dragon', 'p99 ms', 'predation ms', 'predation us/d', 'meals',
+        'all-pairs ms'))
+    results = []
+    for count in counts:
+        case = {'count': count, 'frames': frames, 'seed': seed, 'backend': backend, 'render': render,
+                'all_pairs_max': all_pairs_max, 'density': density}
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+                                env=env, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        all_pairs = '%12.2f' % result['all_pairs_ms'] if 'all_pairs_ms' in result else '%12s' % '-'
+        print('%7s %11s %9.2f %11.2f %9.2f %12.2f %14.2f %7.1f %s' % (
+            count, result['window'], result['frame_ms'], result['frame_us_per_dragon'], result['frame_p99_ms'],
+            result['predation_ms'], result['predation_us_per_dragon'], result['meals_per_frame'], all_pairs))
+        results.append(result)
+    return results
+
+
+def _parse_counts(text):
+    return [int(count) for count in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time whole frames of dragons eating each other as the number '
+                                                 'of dragons grows, as crowded at every count')
+    parser.add_argument('--dragons', type=_parse_counts, default=[500, 1000, 2000, 4000, 8000],
+                        help='comma separated dragon counts')
+    parser.add_argument('--frames', type=int, default=FRAMES, help='frames timed per dragon count')
+    parser.add_argument('--backend', choices=('objects', 'numpy'), default='objects',
+                        help='how enemy dragons are stored')
+    parser.add_argument('--no-render', action='store_true', help='skip drawing the frames')
+    parser.add_argument('--density', type=int, default=DENSITY, help='dragons to every 640x480 of window')
+    parser.add_argument('--all-pairs-max', type=int, default=ALLPAIRSMAX,
+                        help='most dragons to time checking every pair with')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--case', help=argparse.SUPPRESS)  # used by run_suite to time a count in a new process
+    args = parser.parse_args()
+
+    if args.case:
+        case = json.loads(args.case)
+        print(json.dumps(run_count(case['count'], case['frames'], case['seed'], case['backend'], case['render'],
+                                   case['all_pairs_max'], case['density'])))
+        return
+
+    results = run_suite(args.dragons, args.frames, args.seed, args.backend, not args.no_render,
+                        args.all_pairs_max, args.density)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Times drawing the grass, rocks and dragons the way Blueberry Dragon used to (a fill,
+# then one blit and one math.sin per object, from images that were never converted to
+# the display's format) against the batched renderer and its pre-rendered world chunks,
+# on the same game states:
+#
+#   python bench_render.py --frames 300 --backend numpy
+
+import argparse
+import json
+import os
+import time
+
+import pygame
+
+import blueberry_dragon as bd
+
+
+def draw_layers_unbatched(game, dragon_sprites, rock_images):
+    # the way _draw_dragons and _draw_rocks used to work: a fill, then a Rect, a math.sin
+    # and a blit per object, from surfaces that were never converted to the display format
+    surface = bd.DISPLAYSURF
+    surface.fill(bd.GRASSCOLOR)
+
+    for d_obj in game.dragon_objs:
+        facing = bd.RIGHT if d_obj.movex > 0 else bd.LEFT
+        d_rect = pygame.Rect((
+            d_obj.x - game.camera_x,
+            d_obj.y - game.camera_y - game._get_bounce_amount(
+                d_obj.bounce,
+                d_obj.bouncerate,
+                d_obj.bounceheight),
+            d_obj.width,
+            d_obj.height))
+        surface.blit(dragon_sprites.get(facing, d_obj.width, d_obj.height), d_rect)
+
+    for rock in game.world.get_rocks_in_view(game.camera_x, game.camera_y, bd.WINWIDTH, bd.WINHEIGHT):
+        r_rect = pygame.Rect((
+            rock.x - game.camera_x,
+            rock.y - game.camera_y,
+            rock_images[0].get_width(),
+            rock_images[0].get_height()))
+        surface.blit(rock_images[rock.image], r_rect)
+
+
+def run(frames=300, seed=0, dragon_backend=bd.DRAGONBACKEND):
+    # Plays `frames` frames and draws each one both ways. Returns the average
+    # milliseconds per frame of each.
+    bd.init_resources(headless=True)
+    game = bd.BDGame(dragon_backend=dragon_backend, seed=seed, render=False)
+
+    raw_dragon_img = pygame.image.load(os.path.join(bd.IMAGEDIR, 'blueberry-dragon.png'))
+    raw_dragon_sprites = bd.SpriteCache(pygame.transform.flip(raw_dragon_img, True, False), raw_dragon_img)
+    raw_rock_images = [pygame.image.load(os.path.join(bd.IMAGEDIR, 'rock%s.png' % i)) for i in range(1, 4)]
+
+    unbatched_time = 0.0
+    batched_time = 0.0
+    for frame in range(frames):
+        game.run_frame()
+
+        # scale the unconverted sprites before timing, the sprite cache hides that cost in game too
+        draw_layers_unbatched(game, raw_dragon_sprites, raw_rock_images)
+
+        start_time = time.perf_counter()
+        draw_layers_unbatched(game, raw_dragon_sprites, raw_rock_images)
+        unbatched_time += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        game._draw_rocks(game.camera_x, game.camera_y)
+        game._draw_dragons(game.camera_x, game.camera_y, 1.0)
+        batched_time += time.perf_counter() - start_time
+    game.spawn_queue.close()
+
+    return {
+        'frames': frames,
+        'seed': seed,
+        'dragon_backend': dragon_backend,
+        'unbatched_ms': unbatched_time / frames * 1000,
+        'batched_ms': batched_time / frames * 1000,
+        'speedup': unbatched_time / batched_time}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the old and the batched dragon and rock renderer')
+    parser.add_argument('--frames', type=int, default=300, help='frames drawn both ways')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=('objects', 'numpy'), default=bd.DRAGONBACKEND,
+                        help='how enemy dragons are stored')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args.frames, args.seed, args.backend)
+    for key, value in results.items():
+        print('%-15s %s' % (key, round(value, 3) if isinstance(value, float) else value))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+# Measures how the cost of a frame grows with the number of dragons and rocks and the
+# size of the window. Every combination is played headless in its own process (so its
+# peak memory is its own), with the same scripted input as --benchmark, and timed per
+# subsystem with the stage profiler. Results are written as JSON, and can be compared
+# against an earlier run so that a slowdown fails the run. Timings depend on the machine,
+# so no baseline comes with the game: make one with --out on the machine the comparison
+# will run on, before the change being measured:
+#
+#   python bench_scaling.py --dragons 30,1000,10000 --rocks 80,1000 --out baseline.json
+#   python bench_scaling.py --dragons 30,1000,10000 --rocks 80,1000 --baseline baseline.json
+
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not on Windows, peak memory isn't reported there
+    resource = None
+
+FRAMES = 300                              # frames measured per case
+WARMUPFRAMES = 30                         # frames played before measuring, while the first dragons spawn
+TOLERANCE = 0.25                          # how much slower than the baseline a measurement may get
+MINREGRESSIONMS = 0.25                    # timing differences smaller than this are ignored as noise
+
+# which profiler stages make up each subsystem
+SUBSYSTEMS = {
+    'move_dragons': ('move_dragons',),
+    'spawn_despawn': ('delete_unused', 'add_more'),
+    'predation': ('predation',),
+    'collision': ('move_player',),
+    'draw': ('draw_rocks', 'draw_dragons', 'draw_player', 'draw_health', 'compose', 'scale', 'display_update')}
+
+
+def _peak_memory_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def run_case(dragons, rocks, width, height, frames=FRAMES, seed=0, backend='objects', ecosystem=False):
+    # Plays one case in this process and returns its measurements. The window size is
+    # a module constant of the game, so this should be the only case the process runs.
+    # The player's size is capped along the way, so the game doesn't match a real one and
+    # its state checksum isn't reported.
+    import blueberry_dragon as bd
+
+    bd.WINWIDTH, bd.WINHEIGHT = width, height
+    bd.HALF_WINWIDTH, bd.HALF_WINHEIGHT = width // 2, height // 2
+    bd.init_resources(headless=True)
+
+    # the profiler only keeps the last `frames` frames, so the warmup isn't measured
+    profiler = bd.FrameProfiler(capacity=frames)
+    game = bd.BDGame(dragon_backend=backend, seed=seed, profiler=profiler,
+                     config={'NUM_DRAGONS': dragons, 'NUM_ROCKS': rocks, 'ECOSYSTEM': ecosystem})
+
+    # the same random walk as run_benchmark
+    script = random.Random(seed)
+    held_key = None
+
+    start_time = time.perf_counter()
+    for frame in range(WARMUPFRAMES + frames):
+        if frame == WARMUPFRAMES:
+            start_time = time.perf_counter()
+
+        if frame % (bd.FPS // 2) == 0:
+            if held_key is not None:
+                game._handle_key_up(held_key)
+            held_key = script.choice((bd.K_LEFT, bd.K_RIGHT, bd.K_UP, bd.K_DOWN))
+            game._handle_key_down(held_key)
+
+        game.run_frame()
+
+        # in a crowd the player eats its way far past WINSIZE, to sprites many times the size
+        # of the window, which would swamp what's being measured, so it's held at the winning size
+        player = game.player_obj
+        if player.size > game.WINSIZE:
+            player.size = game.WINSIZE
+            player.surface = bd.DRAGON_SPRITES.get(player.facing, game.WINSIZE, game.WINSIZE)
+    total_time = time.perf_counter() - start_time
+
+    stages = profiler.get_summary()
+    subsystems = {name: sum(stages[stage][0] for stage in stage_names)
+                  for name, stage_names in SUBSYSTEMS.items()}
+    subsystems['frame'] = stages['frame'][0]
+
+    return {
+        'dragons': dragons,
+        'rocks': rocks,
+        'window': '%sx%s' % (width, height),
+        'backend': backend,
+        'ecosystem': ecosystem,
+        'frames': frames,
+        'fps': frames / total_time,
+        'frame_p99_ms': stages['frame'][1],
+        'subsystems_ms': subsystems,
+        'stages_ms': {stage: {'mean': mean, 'p99': p99} for stage, (mean, p99) in stages.items()},
+        'peak_memory_mb': _peak_memory_mb(),
+        'dragon_meals': game.dragon_meals}
+
+
+def _case_key(result):
+    return (result['dragons'], result['rocks'], result['window'], result['backend'], result.get('ecosystem', False))
+
+
+def run_suite(dragon_counts, rock_counts, windows, frames=FRAMES, seed=0, backend='objects', ecosystem=False):
+    # Runs every combination of the given counts and window sizes, each in a fresh process
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    results = []
+    for dragons, rocks, (width, height) in itertools.product(dragon_counts, rock_counts, windows):
+        case = {'dragons': dragons, 'rocks': rocks, 'width': width, 'height': height, 'frames': frames,
+                'seed': seed, 'backend': backend, 'ecosystem': ecosystem}
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+                                env=env, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        print('%6s dragons %6s rocks %9s  %8.2f ms/frame  %7.1f MB' % (
+            dragons, rocks, result['window'], result['subsystems_ms']['frame'], result['peak_memory_mb'] or 0))
+        results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # Returns a line for each subsystem time or peak memory that got more than
+    # `tolerance` worse than the same case in the baseline
+    baseline_cases = {_case_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline_cases.get(_case_key(result))
+        if old is None:
+            continue
+
+        name = '%s dragons, %s rocks, %s, %s' % _case_key(result)[:4]
+        if result.get('ecosystem'):
+            name += ', ecosystem'
+        for subsystem, ms in result['subsystems_ms'].items():
+            old_ms = old['subsystems_ms'].get(subsystem)
+            if old_ms is not None and ms - old_ms > MINREGRESSIONMS and ms > old_ms * (1 + tolerance):
+                regressions.append('%s: %s %.3f ms -> %.3f ms' % (name, subsystem, old_ms, ms))
+
+        memory, old_memory = result['peak_memory_mb'], old['peak_memory_mb']
+        if memory and old_memory and memory > old_memory * (1 + tolerance):
+            regressions.append('%s: peak memory %.1f MB -> %.1f MB' % (name, old_memory, memory))
+    return regressions
+
+
+def _parse_counts(text):
+    return [int(count) for count in text.split(',')]
+
+
+def _parse_windows(text):
+    return [tuple(int(n) for n in window.split('x')) for window in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time Blueberry Dragon as the number of dragons, rocks '
+                                                 'and the window size grow')
+    parser.add_argument('--dragons', type=_parse_counts, default=[30, 1000, 10000],
+                        help='comma separated NUM_DRAGONS values')
+    parser.add_argument('--rocks', type=_parse_counts, default=[80, 1000], help='comma separated NUM_ROCKS values')
+    parser.add_argument('--windows', type=_parse_windows, default=[(640, 480), (1280, 720)],
+                        help='comma separated window sizes, like 640x480,1920x1080')
+    parser.add_argument('--frames', type=int, default=FRAMES, help='frames measured per case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=('objects', 'numpy'), default='objects', help='how enemy dragons are stored')
+    parser.add_argument('--ecosystem', action='store_true', help='let the dragons eat each other (ECOSYSTEM)')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='fail if anything got slower or bigger than in this results file')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='allowed slowdown against the baseline, 0.25 is 25%%')
+    parser.add_argument('--case', help=argparse.SUPPRESS)  # used by run_suite to run a case in a new process
+    args = parser.parse_args()
+
+    if args.case:
+        case = json.loads(args.case)
+        print(json.dumps(run_case(case['dragons'], case['rocks'], case['width'], case['height'], case['frames'],
+                                  case['seed'], case['backend'], case['ecosystem'])))
+        return
+
+    results = run_suite(args.dragons, args.rocks, args.windows, args.frames, args.seed, args.backend,
+                        args.ecosystem)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('\n'.join(['', 'slower than the baseline:'] + regressions))
+            sys.exit(1)
+        print('no regressions against %s' % args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Measures how long Blueberry Dragon takes to start: from launching Python, through
+# importing the game, init_resources() and making a BDGame, to the first frame drawn.
+# Every launch is a fresh process, so nothing is already imported or loaded. Launches
+# decoding the PNGs are compared with the launch that builds the asset bundle and the
+# ones that memory map it afterwards:
+#
+#   python bench_startup.py --runs 10 --out startup.json
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = 10                                 # launches timed per mode
+
+STAGES = ('import_ms', 'init_ms', 'game_ms', 'first_frame_ms')
+
+
+def run_once(asset_bundle):
+    # Starts the game in this process and returns how long each part took. Has to be
+    # called before blueberry_dragon is imported for the import to count.
+    start_time = time.perf_counter()
+    import blueberry_dragon as bd
+    import_time = time.perf_counter()
+
+    bd.init_resources(headless=True, asset_bundle=asset_bundle)
+    init_time = time.perf_counter()
+
+    game = bd.BDGame(seed=0)
+    game_time = time.perf_counter()
+
+    game.run_frame()
+    frame_time = time.perf_counter()
+    game.spawn_queue.close()
+
+    return {
+        'import_ms': (import_time - start_time) * 1000,
+        'init_ms': (init_time - import_time) * 1000,
+        'game_ms': (game_time - init_time) * 1000,
+        'first_frame_ms': (frame_time - game_time) * 1000,
+        'bundle_loaded': bd.ASSETS is not None}
+
+
+def launch(asset_bundle):
+    # Runs run_once in a new Python process, and adds the time the whole launch took
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    start_time = time.perf_counter()
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--launch', json.dumps(asset_bundle)],
+                            env=env, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    result['total_ms'] = (time.perf_counter() - start_time) * 1000
+    return result
+
+
+def _summarize(launches):
+    return {key: statistics.median(result[key] for result in launches)
+            for key in STAGES + ('total_ms',)}
+
+
+def run_suite(runs=RUNS):
+    # Returns the median of each stage for PNG launches and bundle launches, and the times
+    # of the one launch that builds the bundle. The bundle goes in a temporary directory
+    # so the game's own one isn't touched.
+    bundle_dir = tempfile.mkdtemp()
+    bundle_path = os.path.join(bundle_dir, 'assets.bundle')
+    try:
+        results = {'png': _summarize([launch(None) for run in range(runs)])}
+        results['build'] = launch(bundle_path)
+        bundle_launches = [launch(bundle_path) for run in range(runs)]
+        if not all(result['bundle_loaded'] for result in bundle_launches):
+            raise RuntimeError('the asset bundle was not loaded')
+        results['bundle'] = _summarize(bundle_launches)
+        results['bundle_bytes'] = os.path.getsize(bundle_path)
+    finally:
+        shutil.rmtree(bundle_dir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time Blueberry Dragon from launch to the first frame')
+    parser.add_argument('--runs', type=int, default=RUNS, help='launches timed per mode')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--launch', help=argparse.SUPPRESS)  # used by launch() to time a start in a new process
+    args = parser.parse_args()
+
+    if args.launch:
+        print(json.dumps(run_once(json.loads(args.launch))))
+        return
+
+    results = run_suite(args.runs)
+    print('%-8s %9s %9s %9s %12s %9s' % (('mode',) + STAGES + ('total_ms',)))
+    for mode in ('png', 'build', 'bundle'):
+        print('%-8s %9.1f %9.1f %9.1f %12.1f %9.1f' % (
+            (mode,) + tuple(results[mode][key] for key in STAGES + ('total_ms',))))
+    print('bundle size %.1f MB' % (results['bundle_bytes'] / (1024.0 * 1024.0)))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,15 +3,44 @@
 # http://inventwithpython.com/pygame
 # Released under a "Simplified BSD" license
 
+import gc
+import importlib.util
+import json
+import mmap
+import os
 import random
+import struct
 import sys
 import time
 import math
-import pygame
+import zlib
+
+# pygame imports numpy for pygame.surfarray and pygame.sndarray, which the game doesn't
+# use, and setuptools' pkg_resources (in pygame.pkgdata) just to find its own files, which
+# it finds as well without it. Those two are most of the game's import time, so they're
+# hidden while pygame is imported, unless something already imported them.
+_hidden_modules = [module_name for module_name in ('numpy', 'pkg_resources') if module_name not in sys.modules]
+sys.modules.update(dict.fromkeys(_hidden_modules))
+try:
+    import pygame
+finally:
+    for module_name in _hidden_modules:
+        del sys.modules[module_name]
+
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+
+numpy = None  # only needed for the 'numpy' dragon backend, which imports it
 
 from pygame.locals import *
 
 FPS = 30                                  # frames per second to update the screen
+SIMHZ = 30                                # simulation steps per second. The speeds, bounces and DIRCHANGEFREQ
+                                          # below are per step and tuned for 30, so change them with it
+MAXSTEPSPERFRAME = 5                      # most simulation steps to catch up on before drawing a frame
 WINWIDTH = 640                            # width of the program's window, in pixels
 WINHEIGHT = 480                           # height in pixels
 HALF_WINWIDTH = int(WINWIDTH / 2)
@@ -31,44 +60,1426 @@ INVULNTIME = 2                            # how long the player is invulnerable
 GAMEOVERTIME = 4                          # how long the "game over" text stays on the screen in seconds
 MAXHEALTH = 3                             # how much health the player starts with
 
-NUM_ROCKS = 80                            # number of grass objects in the active area
+NUM_ROCKS = 80                            # average number of rocks in an area the size of the active area
 NUM_DRAGONS = 30                          # number of dragons in the active area
 DRAGONMINSPEED = 3                        # slowest dragon speed
 DRAGONMAXSPEED = 7                        # fastest dragon speed
 DIRCHANGEFREQ = 2                         # % chance of direction change per frame
+ECOSYSTEM = False                         # if enemy dragons eat the smaller dragons they run into, and grow
+SPAWNTRIES = 4                            # in ECOSYSTEM mode, how many spots a new dragon tries before it spawns on top of another dragon anyway
+SPRITECACHEBYTES = 32 * 1024 * 1024       # how much memory the scaled dragon surfaces may use
+ZOOMSPRITECACHEBYTES = 24 * 1024 * 1024   # how much memory the dragon surfaces scaled down for a zoomed out camera may use
+PREWARMSPRITES = False                    # scale every possible enemy dragon size before the game starts
+DRAGONBACKEND = 'objects'                 # 'objects' keeps a Dragon per dragon, 'numpy' keeps them in arrays
+GRIDCELLSIZE = 128                        # width & height of a spatial hash cell, in pixels
+MAXDRAGONSIZE = (25 + 10) * 3             # largest width or height an enemy dragon can have
+MAXBOUNCEHEIGHT = 50                      # highest an enemy dragon can bounce
+PROFILEFRAMES = 300                       # how many frames the stage profiler remembers
+TRACEFRAMES = 8                           # how deep a stack tracemalloc keeps for each allocation
+SNAPSHOTEVERY = 30                        # frames between allocation snapshots in the allocation profiler
+GCMODE = None                             # 'freeze' the objects made before play starts, 'defer' collections to between frames, or None
+CHUNKSIZE = 256                           # width & height of a chunk of the world, in pixels
+CHUNKCACHEBYTES = 16 * 1024 * 1024        # how much memory the pre-rendered chunks may use
+REPLAYCHECKSUMEVERY = 30                  # frames between state checksums in an input recording
+SPAWNQUEUESIZE = 32                       # how many enemy dragons are kept ready to spawn
+SPAWNWORKERS = min(2, (os.cpu_count() or 1) - 1)  # threads scaling sprites of dragons waiting to spawn, 0 for none
+RENDERSIZE = None                         # (width, height) to draw the game at before scaling it to the window, None for the window size. Same shape as the window
+SMOOTHSCALE = False                       # scale the drawn game to the window with smoothscale instead of scale
+ZOOMLEVELS = (1.0, 0.75, 0.5)             # how far the camera can zoom out as the player grows, 1.0 is no zoom
+ZOOMPLAYERHEIGHT = 0.25                   # the camera zooms out to keep the player at most this much of the window's height
 LEFT = 'left'
 RIGHT = 'right'
 
+IMAGEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+ASSETBUNDLE = os.path.join(IMAGEDIR, 'assets.bundle')  # prebuilt images, made on the first launch. None loads the PNGs every time
+BUNDLESPRITES = False                     # also put the dragon scaled to every enemy size in the bundle (about 25 MB)
+TEXTS = ('Game Over', 'You have achieved OMEGA DRAGON!', '(Press "r" to restart.)')  # rendered into the asset bundle
+
 """
-This program has three data structures to represent the player, enemy dragons, and rock background objects. The data structures are dictionaries with the following keys:
-
-Keys used by all three data structures:
-    'x' - the left edge coordinate of the object in the game world (not a pixel coordinate on the screen)
-    'y' - the top edge coordinate of the object in the game world (not a pixel coordinate on the screen)
-    'rect' - the pygame.Rect object representing where on the screen the object is located.
-    
-Player data structure keys:
-    'surface' - the pygame.Surface object that stores the image of the dragon which will be drawn to the screen.
-    'facing' - either set to LEFT or RIGHT, stores which direction the player is facing.
-    'size' - the width and height of the player in pixels. (The width & height are always the same.)
-    'bounce' - represents at what point in a bounce the player is in. 0 means standing (no bounce), up to BOUNCERATE (the completion of the bounce)
-    'health' - an integer showing how many more times the player can be hit by a larger dragon before dying.
-    
-Enemy Dragon data structure keys:
-    'surface' - the pygame.Surface object that stores the image of the dragon which will be drawn to the screen.
-    'movex' - how many pixels per frame the dragon moves horizontally. A negative integer is moving to the left, a positive to the right.
-    'movey' - how many pixels per frame the dragon moves vertically. A negative integer is moving up, a positive moving down.
-    'width' - the width of the dragon's image, in pixels
-    'height' - the height of the dragon's image, in pixels
-    'bounce' - represents at what point in a bounce the player is in. 0 means standing (no bounce), up to BOUNCERATE (the completion of the bounce)
-    'bouncerate' - how quickly the dragon bounces. A lower number means a quicker bounce.
-    'bounceheight' - how high (in pixels) the dragon bounces
-
-Grass data structure keys:
-    'grassImage' - an integer that refers to the index of the pygame.Surface object in GRASSIMAGES used for this grass object
+This program has three kinds of objects: the player, the enemy dragons and the rocks. They are
+small classes with __slots__, so every attribute is a fixed field instead of a dict key.
+
+Attributes used by both the player and the enemy dragons:
+    x - the left edge coordinate of the object in the game world (not a pixel coordinate on the screen)
+    y - the top edge coordinate of the object in the game world (not a pixel coordinate on the screen)
+    prevx - the x of the object one simulation step ago, to draw it in between steps
+    prevy - the y of the object one simulation step ago
+    surface - the pygame.Surface object that stores the image of the dragon which will be drawn to the screen.
+    bounce - represents at what point in a bounce the dragon is in. 0 means standing (no bounce), up to its bounce rate (the completion of the bounce)
+
+Player attributes:
+    rect - the pygame.Rect the player covers in the game world this step, bounce included, which collisions are checked against. None until the first step.
+    facing - either set to LEFT or RIGHT, stores which direction the player is facing.
+    size - the width and height of the player in pixels. (The width & height are always the same.)
+    health - an integer showing how many more times the player can be hit by a larger dragon before dying.
+
+Enemy Dragon attributes:
+    movex - how many pixels per frame the dragon moves horizontally. A negative integer is moving to the left, a positive to the right.
+    movey - how many pixels per frame the dragon moves vertically. A negative integer is moving up, a positive moving down.
+    width - the width of the dragon's image, in pixels
+    height - the height of the dragon's image, in pixels
+    bouncerate - how quickly the dragon bounces. A lower number means a quicker bounce.
+    bounceheight - how high (in pixels) the dragon bounces
+
+Rock attributes:
+    image - index into GRASSIMAGES of the rock's picture
+    x, y - the top left of the rock in the game world
+
+The rocks in the background belong to the ChunkedWorld that draws them.
 """
 
 
+class Player:
+    __slots__ = ('x', 'y', 'prevx', 'prevy', 'rect', 'surface', 'facing', 'size', 'bounce', 'health')
+
+    def __init__(self, x, y, size, surface, facing, health):
+        self.x = x
+        self.y = y
+        self.prevx = x
+        self.prevy = y
+        self.rect = None
+        self.surface = surface
+        self.facing = facing
+        self.size = size
+        self.bounce = 0
+        self.health = health
+
+
+class Dragon:
+    __slots__ = ('x', 'y', 'prevx', 'prevy', 'surface', 'movex', 'movey', 'width', 'height', 'bounce',
+                 'bouncerate', 'bounceheight')
+
+    def __init__(self, x, y, width, height, movex, movey, surface, bouncerate, bounceheight):
+        self.x = x
+        self.y = y
+        self.prevx = x
+        self.prevy = y
+        self.surface = surface
+        self.movex = movex
+        self.movey = movey
+        self.width = width
+        self.height = height
+        self.bounce = 0
+        self.bouncerate = bouncerate
+        self.bounceheight = bounceheight
+
+
+class Rock:
+    __slots__ = ('image', 'x', 'y')
+
+    def __init__(self, image, x, y):
+        self.image = image
+        self.x = x
+        self.y = y
+
+
+class AssetBundle:
+    """The game's images as raw pixels in a single file, already in the display's pixel
+    format. The dragon is stored flipped, and with BUNDLESPRITES scaled to every size an
+    enemy dragon can have too, and the TEXTS are stored rendered, along with the
+    BOUNCETABLES that were filled in when it was built. build() writes the file once, and
+    later launches memory map it, so only the pixels that actually get used are read from disk.
+
+    The file is a HEADER (magic, version, index length), a JSON index and the pixels.
+    The index maps each image's name to (offset, width, height) in the pixels, lists the
+    (width, height) of the scaled sprites, which follow the images left facing then right
+    facing, and holds the key of what the bundle was built from, so a stale bundle is
+    noticed and rebuilt.
+    """
+
+    MAGIC = b'BDAB'
+    VERSION = 1  # bump when the layout, or how anything in the bundle is made, changes
+    HEADER = struct.Struct('<4sII')
+
+    def __init__(self, path, index, pixels, pixels_start):
+        self.path = path
+        self.masks = tuple(index['key']['masks'])
+        self.surfaces = index['surfaces']
+        self.pixels = pixels  # the mmap of the whole file
+        self.view = memoryview(pixels)  # surfaces are copied straight out of this, without a bytes copy between
+        self.pixels_start = pixels_start
+        self.bounce_tables = {(bounce_rate, bounce_height): tuple(table)
+                              for bounce_rate, bounce_height, table in index['bounce_tables']}
+
+        # (facing, width, height) -> offset of every scaled sprite
+        self.sprites = {}
+        offset = index['sprites_offset']
+        sizes = index['sprite_sizes']
+        for i in range(0, len(sizes), 2):
+            width, height = sizes[i], sizes[i + 1]
+            self.sprites[LEFT, width, height] = offset
+            self.sprites[RIGHT, width, height] = offset + width * height * 4
+            offset += width * height * 8
+
+    def __contains__(self, name):
+        return name in self.surfaces
+
+    def get_surface(self, name):
+        offset, width, height = self.surfaces[name]
+        return self._make_surface(offset, width, height)
+
+    def has_sprite(self, facing, width, height):
+        return (facing, width, height) in self.sprites
+
+    def get_sprite(self, facing, width, height):
+        return self._make_surface(self.sprites[facing, width, height], width, height)
+
+    def _make_surface(self, offset, width, height):
+        start = self.pixels_start + offset
+        surface = pygame.Surface((width, height), SRCALPHA, 32, self.masks)
+        with memoryview(surface.get_buffer()) as buffer:
+            buffer[:] = self.view[start:start + len(buffer)]
+        return surface
+
+    def close(self):
+        self.view.release()
+        self.pixels.close()
+
+    @staticmethod
+    def get_key():
+        # Returns everything the bundle's pixels depend on. The display has to be set up.
+        image_names = ['blueberry-dragon.png'] + ['rock%s.png' % i for i in range(1, 4)]
+        return {
+            'pygame': pygame.version.ver,
+            'masks': list(pygame.Surface((1, 1), SRCALPHA, 32).convert_alpha().get_masks()),
+            'images': {name: os.stat(os.path.join(IMAGEDIR, name)).st_mtime_ns for name in image_names},
+            'texts': list(TEXTS),
+            'sprites': BUNDLESPRITES}
+
+    @classmethod
+    def load(cls, path):
+        # Returns the bundle at path, or None if there isn't one or it's out of date
+        try:
+            with open(path, 'rb') as f:
+                pixels = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):  # missing, unreadable or empty
+            return None
+
+        try:
+            magic, version, index_length = cls.HEADER.unpack_from(pixels)
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError('not a current asset bundle')
+            index = json.loads(pixels[cls.HEADER.size:cls.HEADER.size + index_length].decode())
+            if index['key'] != cls.get_key():
+                raise ValueError('stale asset bundle')
+        except (struct.error, ValueError, KeyError):
+            pixels.close()
+            return None
+
+        return cls(path, index, pixels, cls.HEADER.size + index_length)
+
+    @classmethod
+    def build(cls, path, right_img, left_img, grass_images):
+        # Writes a bundle of the given images (converted to the display's format) and
+        # everything made from them, then returns it loaded. Returns None if it can't
+        # be written, like when the game is installed somewhere read only.
+        surfaces = {'dragon-right': right_img, 'dragon-left': left_img}
+        for i, grass_img in enumerate(grass_images):
+            surfaces['rock%s' % (i + 1)] = grass_img
+        for text in TEXTS:
+            surfaces['text:' + text] = get_font().render(text, True, WHITE).convert_alpha()
+
+        index = {'key': cls.get_key(), 'surfaces': {}, 'sprite_sizes': [],
+                 'bounce_tables': [[bounce_rate, bounce_height, table]
+                                   for (bounce_rate, bounce_height), table in sorted(BOUNCETABLES.items())]}
+        offset = 0
+        for name, surface in surfaces.items():
+            width, height = surface.get_size()
+            index['surfaces'][name] = (offset, width, height)
+            offset += width * height * 4
+        index['sprites_offset'] = offset
+
+        sprites = []
+        for width, height in possible_dragon_sizes() if BUNDLESPRITES else ():
+            index['sprite_sizes'] += [width, height]
+            sprites.append(pygame.transform.scale(left_img, (width, height)))
+            sprites.append(pygame.transform.scale(right_img, (width, height)))
+        index_bytes = json.dumps(index).encode()
+
+        # write to a temporary file first, so a half written bundle is never loaded
+        temp_path = '%s.%s.tmp' % (path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(index_bytes)))
+                f.write(index_bytes)
+                for surface in list(surfaces.values()) + sprites:
+                    f.write(surface.get_buffer().raw)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        return cls.load(path)
+
+
+class SpriteCache:
+    """Scaled dragon surfaces shared by the player and every enemy dragon.
+
+    Surfaces are keyed by (facing, width, height), so flipping direction or spawning
+    a dragon of a size we've already seen is a dict lookup instead of a resample.
+    Once the surfaces take up more than max_bytes, the least recently used ones are
+    dropped. The player grows to sizes far bigger than any enemy dragon, so this is
+    counted in bytes rather than surfaces. Sizes the AssetBundle has pre-scaled are
+    copied out of it instead of being resampled.
+    """
+
+    def __init__(self, left_img, right_img, max_bytes=SPRITECACHEBYTES, bundle=None):
+        self.images = {LEFT: left_img, RIGHT: right_img}
+        self.max_bytes = max_bytes
+        self.bundle = bundle
+        self.surfaces = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    def get(self, facing, width, height):
+        key = (facing, width, height)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = self._scale(facing, width, height)
+        self._store(key, surface)
+        return surface
+
+    def add(self, facing, width, height, surface):
+        # store a surface that was scaled somewhere else, like on a SpawnQueue thread
+        key = (facing, width, height)
+        if key not in self.surfaces:
+            self._store(key, surface)
+        return self.get(facing, width, height)
+
+    def _store(self, key, surface):
+        size = surface.get_bytesize() * key[1] * key[2]
+        if size > self.max_bytes:
+            # only a huge player gets this big, and keeping it would push out everything else
+            return
+
+        self.surfaces[key] = surface
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            # drop the surfaces that were looked up the longest time ago
+            old_key, old_surface = self.surfaces.popitem(last=False)
+            self.bytes -= old_surface.get_bytesize() * old_key[1] * old_key[2]
+            self.evictions += 1
+
+    def prewarm(self, sizes):
+        # scale the given (width, height) sizes ahead of time, for both facings. If they
+        # don't all fit, max_bytes is raised to hold them, so none get evicted again.
+        for width, height in sizes:
+            for facing in (LEFT, RIGHT):
+                key = (facing, width, height)
+                if key not in self.surfaces:
+                    surface = self._scale(facing, width, height)
+                    self.surfaces[key] = surface
+                    self.bytes += surface.get_bytesize() * width * height
+        self.max_bytes = max(self.max_bytes, self.bytes)
+
+    def _scale(self, facing, width, height):
+        if self.bundle is not None and self.bundle.has_sprite(facing, width, height):
+            return self.bundle.get_sprite(facing, width, height)
+        return pygame.transform.scale(self.images[facing], (width, height))
+
+    def is_ready(self, facing, width, height):
+        # True if getting this size doesn't take a resample
+        return ((facing, width, height) in self.surfaces or
+                (self.bundle is not None and self.bundle.has_sprite(facing, width, height)))
+
+    def stats(self):
+        return {
+            'size': len(self.surfaces),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions}
+
+
+class BounceTables(dict):
+    """(bouncerate, bounceheight) -> pixel offset at every point of a bounce.
+
+    Looking up a table that isn't there yet builds it, so drawing never has to call
+    math.sin. init_resources() fills in every pair _make_dragon_spec can pick ahead of time.
+    """
+
+    def __missing__(self, key):
+        bounce_rate, bounce_height = key
+        table = tuple(BDGame._get_bounce_amount(bounce, bounce_rate, bounce_height)
+                      for bounce in range(bounce_rate + 1))
+        self[key] = table
+        return table
+
+
+BOUNCETABLES = BounceTables()
+
+
+class SpawnRings(dict):
+    """(object width, object height, view width, view height) -> the ring of top left
+    corners, relative to the camera, that keep an object of that size in the active area
+    but out of a camera view of that size.
+
+    The ring is cut into four rectangles: above, below, left of and right of the camera
+    view. It's stored as (number of corners, ((first, last + 1, x, y, width), ...)), with the
+    corners of each rectangle numbered row by row, so a number picked uniformly below the
+    total maps straight to a corner, and every corner in the ring is equally likely.
+    """
+
+    def __missing__(self, key):
+        obj_width, obj_height, view_width, view_height = key
+
+        # (x, y, width, height) of each rectangle, counted in whole pixels
+        side_top = max(-obj_height + 1, -view_height)
+        side_height = view_height - side_top
+        rectangles = (
+            (-view_width, -view_height, 3 * view_width + 1, view_height - obj_height + 1),
+            (-view_width, view_height, 3 * view_width + 1, view_height + 1),
+            (-view_width, side_top, view_width - obj_width + 1, side_height),
+            (view_width, side_top, view_width + 1, side_height))
+
+        regions = []
+        total = 0
+        for x, y, width, height in rectangles:
+            if width > 0 and height > 0:
+                regions.append((total, total + width * height, x, y, width))
+                total += width * height
+
+        ring = (total, tuple(regions))
+        self[key] = ring
+        return ring
+
+
+SPAWNRINGS = SpawnRings()
+
+
+def possible_dragon_sizes():
+    # Every (width, height) BDGame._make_dragon_spec can produce. Both sides share the
+    # general size and the multiplier, so they never differ by more than 10 * multiplier.
+    sizes = set()
+    for multiplier in range(1, 4):
+        for general_size in range(5, 26):
+            for extra_width in range(0, 11):
+                for extra_height in range(0, 11):
+                    sizes.add(((general_size + extra_width) * multiplier,
+                               (general_size + extra_height) * multiplier))
+    return sorted(sizes)
+
+
+def _overlaps_any(objs, left, top, right, bottom):
+    # True if any of the objects overlaps the given world area, bounces left out
+    for obj in objs:
+        if obj.x < right and obj.x + obj.width > left and obj.y < bottom and obj.y + obj.height > top:
+            return True
+    return False
+
+
+class SpatialHash:
+    """Uniform grid over world coordinates for finding the objects near an area.
+
+    Each object is filed under the cell holding its top-left corner. max_extent is the
+    largest width or height of any object stored, which tells queries how far up and to
+    the left the corner of an overlapping object can be. Objects must be passed back to
+    update() after they move.
+    """
+
+    def __init__(self, max_extent, cell_size=GRIDCELLSIZE):
+        self.max_extent = max_extent
+        self.cell_size = cell_size
+        self.cells = {}  # (cell x, cell y) -> {id(obj): obj}
+        self.obj_cells = {}  # id(obj) -> (cell x, cell y)
+        self.found = []  # what query() returns, reused from one query to the next
+
+    def __len__(self):
+        return len(self.obj_cells)
+
+    def _get_cell(self, obj):
+        return obj.x // self.cell_size, obj.y // self.cell_size
+
+    def insert(self, obj):
+        cell = self._get_cell(obj)
+        self.cells.setdefault(cell, {})[id(obj)] = obj
+        self.obj_cells[id(obj)] = cell
+
+    def remove(self, obj):
+        cell = self.obj_cells.pop(id(obj))
+        bucket = self.cells[cell]
+        del bucket[id(obj)]
+        if not bucket:
+            del self.cells[cell]
+
+    def update(self, obj):
+        # refile obj if it moved into a different cell. Most steps it hasn't, and the
+        # cell is compared without making a new tuple for it.
+        cell = self.obj_cells[id(obj)]
+        if obj.x // self.cell_size != cell[0] or obj.y // self.cell_size != cell[1]:
+            self.remove(obj)
+            self.insert(obj)
+
+    def query(self, left, top, right, bottom):
+        # Returns the objects that might overlap the given world area. The list is
+        # reused by the next query.
+        cell_size = self.cell_size
+        found = self.found
+        del found[:]
+        for cell_x in range((left - self.max_extent) // cell_size, right // cell_size + 1):
+            for cell_y in range((top - self.max_extent) // cell_size, bottom // cell_size + 1):
+                bucket = self.cells.get((cell_x, cell_y))
+                if bucket:
+                    found.extend(bucket.values())
+        return found
+
+    def remove_outside(self, left, top, width, height):
+        # Removes and returns every object that doesn't overlap the given world area.
+        # Cells entirely out of reach of the area are dropped without looking at
+        # their objects, and cells entirely inside it are skipped.
+        right = left + width
+        bottom = top + height
+        cell_size = self.cell_size
+        removed = []
+        for cell, bucket in list(self.cells.items()):
+            cell_left = cell[0] * cell_size
+            cell_top = cell[1] * cell_size
+
+            if (cell_left >= right or cell_top >= bottom or
+                    cell_left + cell_size + self.max_extent <= left or
+                    cell_top + cell_size + self.max_extent <= top):
+                removed.extend(bucket.values())
+                for key in bucket:
+                    del self.obj_cells[key]
+                del self.cells[cell]
+
+            elif not (cell_left >= left and cell_top >= top and
+                      cell_left + cell_size <= right and cell_top + cell_size <= bottom):
+                # cell straddles the edge of the area, check its objects one by one
+                for obj in list(bucket.values()):
+                    if not (obj.x < right and obj.x + obj.width > left and
+                            obj.y < bottom and obj.y + obj.height > top):
+                        removed.append(obj)
+                        self.remove(obj)
+
+        return removed
+
+
+class SweepAndPrune:
+    """Finds the pairs of objects whose rects overlap, by sorting them along x.
+
+    The sorted list is kept from one step to the next. Objects only move a few pixels a
+    step, so it's still almost sorted, and Python's sort (which picks up the sorted runs
+    already there) puts it back in order in close to linear time. A sweep along x then
+    pairs each object with the ones after it that start before its right edge, and only
+    those pairs get their y compared. Objects are passed to add() and remove() as they
+    come and go.
+    """
+
+    def __init__(self):
+        self.objs = []  # sorted by x as of the last get_pairs()
+        self.removed = {}  # id(obj) -> obj for objects removed since then
+
+    def __len__(self):
+        return len(self.objs) - len(self.removed)
+
+    def add(self, objs):
+        self.objs.extend(objs)
+
+    def remove(self, objs):
+        # removed objects are held on to until they're filtered out, so their ids can't be reused
+        for obj in objs:
+            self.removed[id(obj)] = obj
+
+    def get_pairs(self):
+        # Returns (obj, other obj) for every two objects that overlap, in the order
+        # of the left one along x
+        if self.removed:
+            removed = self.removed
+            self.objs = [obj for obj in self.objs if id(obj) not in removed]
+            self.removed = {}
+
+        objs = self.objs
+        objs.sort(key=attrgetter('x'))
+        lefts = [obj.x for obj in objs]
+
+        pairs = []
+        for i, obj in enumerate(objs):
+            end = bisect_left(lefts, obj.x + obj.width, i + 1)
+            if end > i + 1:
+                top = obj.y
+                bottom = top + obj.height
+                pairs.extend((obj, other) for other in objs[i + 1:end]
+                             if other.y < bottom and other.y + other.height > top)
+        return pairs
+
+
+class DragonRef:
+    """A Dragon-like view of one row of a DragonArrayStore.
+
+    Lets the collision code keep reading dragon.x, dragon.surface and so on
+    without caring which backend holds the dragons. The column attributes are
+    filled in below DragonArrayStore.
+    """
+
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def surface(self):
+        return self.store.surfaces[self.index]
+
+    @surface.setter
+    def surface(self, value):
+        self.store.surfaces[self.index] = value
+
+
+def _column_property(field):
+    def get(ref):
+        return int(ref.store.columns[field][ref.index])
+
+    def set(ref, value):
+        ref.store.columns[field][ref.index] = value
+
+    return property(get, set)
+
+
+def has_numpy():
+    # True if the 'numpy' dragon backend can be used, without importing numpy
+    return numpy is not None or importlib.util.find_spec('numpy') is not None
+
+
+class DragonArrayStore:
+    """Enemy dragons kept as a struct of numpy arrays, one array per field.
+
+    Movement, bounce wraparound and random direction changes run as one batched
+    operation over every dragon per frame. Indexing or iterating yields DragonRef
+    accessors. Deleting a dragon moves the last row into its slot, so deleting
+    while walking the store backwards (like BDGame does) is safe.
+    """
+
+    FIELDS = ('x', 'y', 'prevx', 'prevy', 'movex', 'movey', 'width', 'height', 'bounce', 'bouncerate',
+              'bounceheight')
+
+    def __init__(self, capacity=64, seed=None):
+        global numpy
+        if numpy is None:
+            try:
+                import numpy
+            except ImportError:
+                raise RuntimeError("the 'numpy' dragon backend needs numpy installed")
+
+        self.rng = numpy.random.default_rng(seed)
+        self.count = 0
+        self.columns = {field: numpy.zeros(capacity, dtype=numpy.int64) for field in self.FIELDS}
+        self.surfaces = []  # scaled dragon surface for each row
+        self.refs = []  # DragonRef for each row
+        self.bounce_offsets = None
+
+        # the rows sorted along x by the last get_overlapping_pairs(), and the rows added
+        # since then. Only kept once get_overlapping_pairs() has been called.
+        self.sweep_refs = None
+        self.unswept_refs = []
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.refs)
+
+    def __getitem__(self, index):
+        return self.refs[index]
+
+    def __delitem__(self, index):
+        last = self.count - 1
+        if index < 0:
+            index += self.count
+
+        self.refs[index].index = -1
+        if index != last:
+            for column in self.columns.values():
+                column[index] = column[last]
+            self.surfaces[index] = self.surfaces[last]
+            self.refs[index] = self.refs[last]
+            self.refs[index].index = index
+
+        self.surfaces.pop()
+        self.refs.pop()
+        self.count = last
+
+    def append(self, dragon):
+        # add a dragon made by BDGame._make_new_dragons
+        if self.count == len(self.columns['x']):
+            for field, column in self.columns.items():
+                self.columns[field] = numpy.concatenate((column, numpy.zeros_like(column)))
+
+        for field in self.FIELDS:
+            self.columns[field][self.count] = getattr(dragon, field)
+        self.surfaces.append(dragon.surface)
+        self.refs.append(DragonRef(self, self.count))
+        if self.sweep_refs is not None:
+            self.unswept_refs.append(self.refs[-1])
+        self.count += 1
+
+    def extend(self, dragons):
+        # add a batch of dragons, growing the columns at most once
+        count = self.count + len(dragons)
+        if count > len(self.columns['x']):
+            capacity = max(count, 2 * len(self.columns['x']))
+            for field, column in self.columns.items():
+                self.columns[field] = numpy.concatenate((column, numpy.zeros(capacity - len(column), column.dtype)))
+
+        for field in self.FIELDS:
+            self.columns[field][self.count:count] = [getattr(dragon, field) for dragon in dragons]
+        self.surfaces.extend(dragon.surface for dragon in dragons)
+        self.refs.extend(DragonRef(self, index) for index in range(self.count, count))
+        if self.sweep_refs is not None:
+            self.unswept_refs.extend(self.refs[self.count:count])
+        self.count = count
+
+    def _random_velocities(self, count, min_speed, max_speed):
+        speed = self.rng.integers(min_speed, max_speed + 1, count)
+        return numpy.where(self.rng.integers(0, 2, count) == 0, speed, -speed)
+
+    def move(self, dir_change_freq, min_speed, max_speed):
+        n = self.count
+        x, y = self.columns['x'][:n], self.columns['y'][:n]
+        movex, movey = self.columns['movex'][:n], self.columns['movey'][:n]
+        bounce = self.columns['bounce'][:n]
+
+        # move the dragons, and adjust for their bounce
+        self.columns['prevx'][:n] = x
+        self.columns['prevy'][:n] = y
+        x += movex
+        y += movey
+        bounce += 1
+        bounce[bounce > self.columns['bouncerate'][:n]] = 0
+
+        # random chance they change direction
+        changed = numpy.flatnonzero(self.rng.integers(0, 100, n) < dir_change_freq)
+        if len(changed):
+            movex[changed] = self._random_velocities(len(changed), min_speed, max_speed)
+            movey[changed] = self._random_velocities(len(changed), min_speed, max_speed)
+
+            widths = self.columns['width']
+            heights = self.columns['height']
+            for i, new_movex in zip(changed.tolist(), movex[changed].tolist()):
+                facing = RIGHT if new_movex > 0 else LEFT
+                self.surfaces[i] = DRAGON_SPRITES.get(facing, int(widths[i]), int(heights[i]))
+
+    def _get_bounce_offsets(self):
+        # BOUNCETABLES as one array, indexed by [bouncerate, bounceheight, bounce]
+        if self.bounce_offsets is None:
+            self.bounce_offsets = numpy.zeros((19, MAXBOUNCEHEIGHT + 1, 19), dtype=numpy.int64)
+            for bounce_rate in range(10, 19):
+                for bounce_height in range(10, MAXBOUNCEHEIGHT + 1):
+                    self.bounce_offsets[bounce_rate, bounce_height, :bounce_rate + 1] = BOUNCETABLES[bounce_rate,
+                                                                                                   bounce_height]
+        return self.bounce_offsets
+
+    def get_blits(self, camera_x, camera_y, alpha, width, height, pixels=CHUNKSIZE):
+        # Returns (surface, screen position) for every dragon that shows up in a view of
+        # the given size, drawn `alpha` of the way from its previous position and scaled
+        # by pixels / CHUNKSIZE, same as BDGame._draw_dragons does for the other backend
+        n = self.count
+        columns = self.columns
+        prevx, prevy = columns['prevx'][:n], columns['prevy'][:n]
+        x = prevx + ((columns['x'][:n] - prevx) * alpha).astype(numpy.int64)
+        y = (prevy + ((columns['y'][:n] - prevy) * alpha).astype(numpy.int64) -
+             self._get_bounce_offsets()[columns['bouncerate'][:n], columns['bounceheight'][:n], columns['bounce'][:n]])
+        widths, heights = columns['width'][:n], columns['height'][:n]
+        if pixels != CHUNKSIZE:
+            x = x * pixels // CHUNKSIZE - camera_x * pixels // CHUNKSIZE
+            y = y * pixels // CHUNKSIZE - camera_y * pixels // CHUNKSIZE
+            widths = numpy.maximum(widths * pixels // CHUNKSIZE, 1)
+            heights = numpy.maximum(heights * pixels // CHUNKSIZE, 1)
+        else:
+            x -= camera_x
+            y -= camera_y
+        visible = numpy.flatnonzero((x < width) & (x + widths > 0) & (y < height) & (y + heights > 0))
+
+        positions = zip(x[visible].tolist(), y[visible].tolist())
+        if pixels == CHUNKSIZE:
+            surfaces = self.surfaces
+            return [(surfaces[i], position) for i, position in zip(visible.tolist(), positions)]
+
+        movex = columns['movex'][:n]
+        return [(ZOOMED_SPRITES.get(RIGHT if going_right else LEFT, w, h), position)
+                for going_right, w, h, position in zip((movex[visible] > 0).tolist(), widths[visible].tolist(),
+                                                       heights[visible].tolist(), positions)]
+
+    def remove_outside(self, left, top, width, height):
+        # delete every dragon that doesn't overlap the given rect, the same test
+        # SpatialHash.remove_outside does, but for all dragons at once
+        n = self.count
+        x, y = self.columns['x'][:n], self.columns['y'][:n]
+        inside = ((x < left + width) & (x + self.columns['width'][:n] > left) &
+                  (y < top + height) & (y + self.columns['height'][:n] > top))
+        for i in numpy.flatnonzero(~inside)[::-1].tolist():
+            del self[i]
+
+    def get_overlapping_pairs(self):
+        # Returns (DragonRef, DragonRef) for every two dragons that overlap, like
+        # SweepAndPrune.get_pairs() but with the sort and the sweep done in numpy. The
+        # order along x is kept between calls as DragonRefs, which follow their rows
+        # around as other rows get deleted, and deleted ones are dropped.
+        if self.sweep_refs is None:
+            refs = list(self.refs)
+        else:
+            refs = [ref for ref in self.sweep_refs if ref.index >= 0]
+            refs.extend(ref for ref in self.unswept_refs if ref.index >= 0)
+        self.unswept_refs = []
+
+        # a stable sort of an almost sorted array only has to merge a few runs
+        rows = numpy.fromiter((ref.index for ref in refs), numpy.int64, len(refs))
+        order = numpy.argsort(self.columns['x'][rows], kind='stable')
+        rows = rows[order]
+        self.sweep_refs = [refs[i] for i in order.tolist()]
+
+        # dragon i in sweep order gets paired with dragons i + 1 up to the first one
+        # that starts at or after its right edge
+        x, y = self.columns['x'], self.columns['y']
+        widths, heights = self.columns['width'], self.columns['height']
+        lefts = x[rows]
+        ends = numpy.searchsorted(lefts, lefts + widths[rows], 'left')
+        counts = numpy.maximum(ends - numpy.arange(1, len(rows) + 1), 0)
+        first = numpy.repeat(numpy.arange(len(rows)), counts)
+        second = first + 1 + numpy.arange(len(first)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+
+        a, b = rows[first], rows[second]
+        overlap = numpy.flatnonzero((y[a] < y[b] + heights[b]) & (y[b] < y[a] + heights[a]))
+        return [(self.refs[i], self.refs[j]) for i, j in zip(a[overlap].tolist(), b[overlap].tolist())]
+
+    def query(self, left, top, right, bottom):
+        # Returns the dragons overlapping the given world area.
+        n = self.count
+        x, y = self.columns['x'][:n], self.columns['y'][:n]
+        nearby = ((x < right) & (x + self.columns['width'][:n] > left) &
+                  (y < bottom) & (y + self.columns['height'][:n] > top))
+        return [self.refs[i] for i in numpy.flatnonzero(nearby).tolist()]
+
+
+for _field in DragonArrayStore.FIELDS:
+    setattr(DragonRef, _field, _column_property(_field))
+
+
+class ChunkedWorld:
+    """The grass and rocks of the endless world, split into square chunks.
+
+    A chunk's rock layout only depends on the world seed and the chunk's coordinates,
+    so a place looks the same every time the player comes back to it. Each chunk is
+    rendered once (grass, its rocks, and the rocks hanging over from its neighbours)
+    into an opaque surface, kept in an LRU cache bounded by max_bytes. get_blits()
+    raises max_bytes to two views' worth of chunks when a view needs more than that.
+    """
+
+    def __init__(self, seed, rock_images, rocks_per_chunk, chunk_size=CHUNKSIZE, max_bytes=CHUNKCACHEBYTES):
+        self.seed = seed
+        self.rock_images = rock_images
+        self.rocks_per_chunk = rocks_per_chunk
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+
+        self.surfaces = OrderedDict()  # (chunk x, chunk y, size in pixels) -> pre-rendered chunk
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_rocks(self, chunk_x, chunk_y):
+        # Returns a Rock for every rock whose top left corner is in the chunk.
+        rng = random.Random('%s:%s:%s' % (self.seed, chunk_x, chunk_y))
+        count = int(self.rocks_per_chunk)
+        if rng.random() < self.rocks_per_chunk - count:
+            count += 1
+
+        left = chunk_x * self.chunk_size
+        top = chunk_y * self.chunk_size
+        return [Rock(rng.randrange(len(self.rock_images)),
+                     left + rng.randrange(self.chunk_size),
+                     top + rng.randrange(self.chunk_size)) for i in range(count)]
+
+    def get_surface(self, chunk_x, chunk_y, pixels=None):
+        # Returns the chunk drawn `pixels` wide and tall, chunk_size by default. Chunks for a
+        # zoomed out camera are scaled down from the full size one once and cached too.
+        pixels = pixels or self.chunk_size
+        key = (chunk_x, chunk_y, pixels)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        if pixels == self.chunk_size:
+            surface = self._render_chunk(chunk_x, chunk_y)
+        else:
+            surface = pygame.transform.scale(self.get_surface(chunk_x, chunk_y), (pixels, pixels))
+        self.surfaces[key] = surface
+        self.bytes += surface.get_bytesize() * pixels * pixels
+        while self.bytes > self.max_bytes and len(self.surfaces) > 1:
+            old_key, old_surface = self.surfaces.popitem(last=False)
+            self.bytes -= old_surface.get_bytesize() * old_key[2] * old_key[2]
+            self.evictions += 1
+
+        return surface
+
+    def _render_chunk(self, chunk_x, chunk_y):
+        surface = pygame.Surface((self.chunk_size, self.chunk_size)).convert()
+        surface.fill(GRASSCOLOR)
+
+        # rocks near the left or top edge of a chunk stick out into the next one
+        left = chunk_x * self.chunk_size
+        top = chunk_y * self.chunk_size
+        for offset_y in (-1, 0):
+            for offset_x in (-1, 0):
+                surface.blits([(self.rock_images[rock.image], (rock.x - left, rock.y - top))
+                               for rock in self.get_rocks(chunk_x + offset_x, chunk_y + offset_y)], False)
+
+        return surface
+
+    def get_blits(self, camera_x, camera_y, width, height, pixels=None):
+        # Returns (chunk surface, screen position) for every chunk in a width x height
+        # pixel view with its top left at camera_x, camera_y in the world, with each
+        # chunk drawn `pixels` wide and tall (chunk_size by default, no zoom).
+        pixels = pixels or self.chunk_size
+        left = camera_x * pixels // self.chunk_size
+        top = camera_y * pixels // self.chunk_size
+        chunk_xs = range(left // pixels, (left + width - 1) // pixels + 1)
+        chunk_ys = range(top // pixels, (top + height - 1) // pixels + 1)
+
+        # a big view can need more chunks than max_bytes holds, and then the LRU would evict
+        # chunks still on screen and render them again every frame. Chunks are in the
+        # display's format, and zoomed ones keep the full size chunk they're scaled from.
+        chunk_pixels = pixels * pixels
+        if pixels != self.chunk_size:
+            chunk_pixels += self.chunk_size * self.chunk_size
+        view_bytes = len(chunk_xs) * len(chunk_ys) * chunk_pixels * pygame.display.get_surface().get_bytesize()
+        self.max_bytes = max(self.max_bytes, 2 * view_bytes)
+
+        blits = []
+        for chunk_y in chunk_ys:
+            for chunk_x in chunk_xs:
+                blits.append((self.get_surface(chunk_x, chunk_y, pixels),
+                              (chunk_x * pixels - left, chunk_y * pixels - top)))
+        return blits
+
+    def get_rocks_in_view(self, camera_x, camera_y, width, height):
+        # Returns every rock that could be seen in the camera view, as from get_rocks().
+        max_rock_size = max(max(image.get_size()) for image in self.rock_images)
+        chunk_size = self.chunk_size
+        rocks = []
+        for chunk_y in range((camera_y - max_rock_size) // chunk_size, (camera_y + height - 1) // chunk_size + 1):
+            for chunk_x in range((camera_x - max_rock_size) // chunk_size, (camera_x + width - 1) // chunk_size + 1):
+                rocks.extend(self.get_rocks(chunk_x, chunk_y))
+        return rocks
+
+    def stats(self):
+        return {
+            'chunks': len(self.surfaces),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions}
+
+
+class FrameProfiler:
+    """Wall time spent in each stage of BDGame.run_frame over the last `capacity` frames.
+
+    start_frame() is called at the top of a frame and mark(stage) as each stage
+    finishes, which charges the time since the previous mark to that stage. Samples
+    live in a preallocated ring buffer, so recording never allocates.
+    """
+
+    STAGES = ('events', 'invulnerable', 'move_dragons', 'delete_unused', 'add_more', 'predation', 'camera',
+              'move_player', 'draw_rocks', 'draw_dragons', 'draw_player', 'draw_health', 'compose', 'scale',
+              'overlay', 'display_update', 'gc')
+
+    def __init__(self, capacity=PROFILEFRAMES, dump_path=None):
+        self.capacity = capacity
+        self.dump_path = dump_path  # where to save the recording when the game exits
+        self.stage_index = {stage: i for i, stage in enumerate(self.STAGES)}
+        self.samples = array('d', bytes(8 * capacity * len(self.STAGES)))
+        self.frames = 0  # how many frames have been recorded in total
+
+        self.overlay_visible = False
+        self.overlay_font = None
+        self.overlay_surfs = []
+
+        self._zero_row = array('d', bytes(8 * len(self.STAGES)))
+        self._row_start = 0
+        self._last_mark = 0.0
+
+    def start_frame(self):
+        self._row_start = (self.frames % self.capacity) * len(self.STAGES)
+        self.samples[self._row_start:self._row_start + len(self.STAGES)] = self._zero_row
+        self._last_mark = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.samples[self._row_start + self.stage_index[stage]] += now - self._last_mark
+        self._last_mark = now
+
+    def end_frame(self):
+        self.frames += 1
+
+    def get_rows(self):
+        # Returns (frame number, [seconds per stage]) for each remembered frame, oldest first.
+        first_frame = max(0, self.frames - self.capacity)
+        rows = []
+        for frame in range(first_frame, self.frames):
+            start = (frame % self.capacity) * len(self.STAGES)
+            rows.append((frame, self.samples[start:start + len(self.STAGES)].tolist()))
+        return rows
+
+    def get_summary(self):
+        # Returns {stage: (average ms, p99 ms)} over the remembered frames, plus the whole frame.
+        rows = self.get_rows()
+        if not rows:
+            return {}
+
+        columns = list(zip(*(times for frame, times in rows)))
+        columns.append([sum(times) for frame, times in rows])
+        summary = {}
+        for stage, column in zip(self.STAGES + ('frame',), columns):
+            column = sorted(column)
+            summary[stage] = (sum(column) / len(column) * 1000, _percentile(column, 99) * 1000)
+        return summary
+
+    def dump(self, path):
+        # save the recording as CSV or JSON, depending on the file extension
+        rows = self.get_rows()
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump({
+                    'stages': self.STAGES,
+                    'frames': [{'frame': frame, 'seconds': times} for frame, times in rows],
+                    'summary_ms': self.get_summary()}, f, indent=2)
+        else:
+            with open(path, 'w') as f:
+                f.write(','.join(('frame',) + self.STAGES + ('total',)) + '\n')
+                for frame, times in rows:
+                    f.write(','.join([str(frame)] + ['%.7f' % t for t in times] + ['%.7f' % sum(times)]) + '\n')
+
+    def draw_overlay(self, surface):
+        # show the rolling average and p99 of each stage in the top right corner,
+        # re-rendering the text once a second
+        if self.overlay_font is None:
+            self.overlay_font = get_font(12)
+
+        if self.frames % FPS == 0 or not self.overlay_surfs:
+            lines = ['%-15s %6s %6s' % ('stage (ms)', 'avg', 'p99')]
+            for stage, (average, p99) in self.get_summary().items():
+                lines.append('%-15s %6.2f %6.2f' % (stage, average, p99))
+            self.overlay_surfs = [self.overlay_font.render(line, True, WHITE, GRASSCOLOR) for line in lines]
+
+        for i, text_surf in enumerate(self.overlay_surfs):
+            surface.blit(text_surf, (surface.get_width() - text_surf.get_width() - 5, 5 + i * 14))
+
+
+def _get_last_lines(nodes, last_line):
+    # Yields (node, the line it ends on) for a list of sibling ast nodes, the last of which
+    # ends by last_line. ast only says where a node ends from Python 3.8, so before that
+    # each node is taken to end just before the next one starts.
+    for node, next_node in zip(nodes, nodes[1:] + [None]):
+        end = getattr(node, 'end_lineno', None)
+        if end is None:
+            end = next_node.lineno - 1 if next_node is not None else last_line
+        yield node, end
+
+
+class AllocationProfiler(FrameProfiler):
+    """A FrameProfiler that also accounts for the memory each stage of a frame allocates
+    and the garbage collections that run during it.
+
+    Per stage it counts the memory blocks allocated and not freed again, the most memory
+    in use above where the stage started (which is how short-lived objects show up), and
+    the collections that ran with how long they paused the game (the most memory needs
+    tracemalloc.reset_peak(), from Python 3.9, and is left out before that). Every snapshot_every
+    frames it compares tracemalloc snapshots from the start and the end of the frame, and
+    adds up the allocations still alive by the function in this file that made them.
+    """
+
+    def __init__(self, capacity=PROFILEFRAMES, dump_path=None, snapshot_every=SNAPSHOTEVERY):
+        global tracemalloc
+        import tracemalloc  # only imported when it's used, like argparse and ast
+
+        FrameProfiler.__init__(self, capacity, dump_path)
+        self.snapshot_every = snapshot_every
+        self.started_tracing = not tracemalloc.is_tracing()  # if so, close() stops it again
+        if self.started_tracing:
+            tracemalloc.start(TRACEFRAMES)
+        self.tracks_peaks = hasattr(tracemalloc, 'reset_peak')
+
+        # totals per stage over every frame
+        self.net_blocks = array('q', bytes(8 * len(self.STAGES)))
+        self.peak_bytes = array('q', bytes(8 * len(self.STAGES)))  # the largest in any one frame
+        self.collections = array('q', bytes(8 * len(self.STAGES)))
+        self.gc_seconds = array('d', bytes(8 * len(self.STAGES)))
+
+        self.generation_collections = [0, 0, 0]
+        self.frames_with_collections = 0
+        self.methods = {}  # 'Class.method' -> [blocks, bytes] still alive at the end of a snapshot frame
+
+        self._function_names = None
+        self._snapshot = None
+        self._in_snapshot = False
+        self._last_blocks = 0
+        self._last_traced = 0
+        self._frame_collections = 0
+        self._pending_collections = 0
+        self._pending_gc_seconds = 0.0
+        self._gc_start_time = 0.0
+        gc.callbacks.append(self._on_gc)
+
+    def close(self):
+        # stops listening to the garbage collector, and tracing allocations if it started that
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def _on_gc(self, phase, info):
+        if self._in_snapshot:
+            # set off by the profiler's own snapshots
+            return
+        if phase == 'start':
+            self._gc_start_time = time.perf_counter()
+            return
+
+        self._pending_collections += 1
+        self._pending_gc_seconds += time.perf_counter() - self._gc_start_time
+        self.generation_collections[info['generation']] += 1
+
+    def start_frame(self):
+        if self.frames % self.snapshot_every == 0:
+            self._in_snapshot = True
+            self._snapshot = tracemalloc.take_snapshot()
+            self._in_snapshot = False
+
+        # collections since the last frame ended are charged to its first stage
+        self._frame_collections = 0
+        if self.tracks_peaks:
+            tracemalloc.reset_peak()
+        self._last_traced = tracemalloc.get_traced_memory()[0]
+        self._last_blocks = sys.getallocatedblocks()
+        FrameProfiler.start_frame(self)
+
+    def mark(self, stage):
+        FrameProfiler.mark(self, stage)
+        i = self.stage_index[stage]
+        self.net_blocks[i] += sys.getallocatedblocks() - self._last_blocks
+
+        if self.tracks_peaks:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak_bytes[i] = max(self.peak_bytes[i], peak - self._last_traced)
+
+        if self._pending_collections:
+            self.collections[i] += self._pending_collections
+            self.gc_seconds[i] += self._pending_gc_seconds
+            self._frame_collections += self._pending_collections
+            self._pending_collections = 0
+            self._pending_gc_seconds = 0.0
+
+        # what the bookkeeping above allocated isn't counted against the next stage
+        if self.tracks_peaks:
+            tracemalloc.reset_peak()
+        self._last_traced = tracemalloc.get_traced_memory()[0]
+        self._last_blocks = sys.getallocatedblocks()
+        self._last_mark = time.perf_counter()
+
+    def end_frame(self):
+        if self._frame_collections:
+            self.frames_with_collections += 1
+
+        if self._snapshot is not None:
+            # (filtering the snapshots by file first is several times slower than this)
+            self._in_snapshot = True
+            for stat in tracemalloc.take_snapshot().compare_to(self._snapshot, 'traceback'):
+                if stat.count_diff:
+                    name = self._get_function_name(stat.traceback)
+                    if name is not None:
+                        totals = self.methods.setdefault(name, [0, 0])
+                        totals[0] += stat.count_diff
+                        totals[1] += stat.size_diff
+            self._snapshot = None
+            self._in_snapshot = False
+
+        FrameProfiler.end_frame(self)
+
+    def _get_function_name(self, traceback):
+        # Returns 'Class.method' of the innermost frame of traceback in this file, or None
+        # when there isn't one or it's the profiler itself
+        if self._function_names is None:
+            # line number -> name of the function (or method) it's in
+            self._function_names = {}
+            import ast
+            with open(__file__) as f:
+                source = f.read()
+            for node, end in _get_last_lines(ast.parse(source).body, source.count('\n') + 1):
+                functions = [(node.name, node, end)] if isinstance(node, ast.FunctionDef) else []
+                if isinstance(node, ast.ClassDef):
+                    functions = [('%s.%s' % (node.name, item.name), item, item_end)
+                                 for item, item_end in _get_last_lines(node.body, end)
+                                 if isinstance(item, ast.FunctionDef)]
+                for name, function, function_end in functions:
+                    for lineno in range(function.lineno, function_end + 1):
+                        self._function_names[lineno] = name
+
+        for frame in reversed(traceback):
+            if frame.filename == __file__:
+                name = self._function_names.get(frame.lineno, '<module>')
+                # the profiler's own snapshots aren't part of the game
+                return None if name.startswith('AllocationProfiler.') else name
+        return None
+
+    def get_allocation_summary(self):
+        # Returns per frame averages of what each stage allocated and collected, and the
+        # allocations still alive after the snapshot frames by the function that made them
+        frames = max(self.frames, 1)
+        snapshots = max((self.frames + self.snapshot_every - 1) // self.snapshot_every, 1)
+        stages = {}
+        for i, stage in enumerate(self.STAGES):
+            stages[stage] = {
+                'net_blocks_per_frame': self.net_blocks[i] / float(frames),
+                'peak_kb': self.peak_bytes[i] / 1024.0 if self.tracks_peaks else None,
+                'collections': self.collections[i],
+                'gc_ms': self.gc_seconds[i] * 1000}
+
+        methods = sorted(self.methods.items(), key=lambda item: -item[1][1])
+        return {
+            'frames': self.frames,
+            'net_blocks_per_frame': sum(self.net_blocks) / float(frames),
+            'collections': {'gen%s' % generation: count
+                            for generation, count in enumerate(self.generation_collections)},
+            'frames_with_collections': self.frames_with_collections,
+            'gc_ms': sum(self.gc_seconds) * 1000,
+            'stages': stages,
+            'methods': {name: {'blocks_per_frame': blocks / float(snapshots),
+                               'bytes_per_frame': size / float(snapshots)}
+                        for name, (blocks, size) in methods}}
+
+    def dump(self, path):
+        # the stage timings go to path, like FrameProfiler, and the allocations next to it
+        FrameProfiler.dump(self, path)
+        with open(os.path.splitext(path)[0] + '.alloc.json', 'w') as f:
+            json.dump(self.get_allocation_summary(), f, indent=2)
+
+
+class SpawnQueue:
+    """Enemy dragons made ahead of time, waiting to be spawned.
+
+    make_spec() returns the (width, height, movex, movey, bouncerate, bounceheight) of a
+    new dragon. fill() tops the queue up to max_size specs, and for every sprite that
+    isn't in DRAGON_SPRITES yet, starts scaling it on a pool of threads
+    (pygame.transform.scale lets go of the GIL while it works), once per size. take()
+    hands out the oldest spec with its surface. If a thread is still scaling it, take()
+    waits for it to finish. If no thread was asked to, or the queue is empty, the work is
+    done right there instead, and counted as a sync fallback.
+
+    An AssetBundle built with BUNDLESPRITES already holds every size an enemy dragon can
+    have, and copying one out of it is quicker than handing it to a thread, so then the
+    threads aren't started.
+
+    Specs always come out in the order they were made, and a surface only depends on
+    its spec, so a game plays out the same no matter how fast the threads are.
+    """
+
+    def __init__(self, make_spec, max_size=SPAWNQUEUESIZE, workers=SPAWNWORKERS):
+        self.make_spec = make_spec
+        self.max_size = max_size
+        if DRAGON_SPRITES.bundle is not None and DRAGON_SPRITES.bundle.sprites:
+            workers = 0
+        self.executor = ThreadPoolExecutor(workers) if workers else None
+        self.queue = deque()  # (spec, facing, future scaled surface or None)
+        self.pending = {}  # (facing, width, height) -> future, for sprites submitted and not taken yet
+
+        self.taken = 0
+        self.prefetched = 0  # dragons whose sprite a thread scaled in time
+        self.waited = 0  # dragons whose sprite a thread was still scaling when they were taken
+        self.sync_fallbacks = 0  # dragons that had to be made or scaled in take()
+        self.min_depth = max_size  # the emptiest the queue has been
+
+    def __len__(self):
+        return len(self.queue)
+
+    def fill(self):
+        while len(self.queue) < self.max_size:
+            spec = self.make_spec()
+            width, height, movex = spec[:3]
+            facing = LEFT if movex < 0 else RIGHT
+
+            future = None
+            if self.executor is not None and not DRAGON_SPRITES.is_ready(facing, width, height):
+                future = self.pending.get((facing, width, height))
+                if future is None:
+                    future = self.executor.submit(pygame.transform.scale, DRAGON_SPRITES.images[facing],
+                                                  (width, height))
+                    self.pending[facing, width, height] = future
+            self.queue.append((spec, facing, future))
+
+    def take(self):
+        # Returns (spec, surface) for the next dragon to spawn
+        self.taken += 1
+        self.min_depth = min(self.min_depth, len(self.queue))
+        if not self.queue:
+            self.sync_fallbacks += 1
+            spec = self.make_spec()
+            return spec, DRAGON_SPRITES.get(LEFT if spec[2] < 0 else RIGHT, spec[0], spec[1])
+
+        spec, facing, future = self.queue.popleft()
+        width, height = spec[:2]
+        if future is not None:
+            # once it's in DRAGON_SPRITES, later specs of the same size get it from there
+            self.pending.pop((facing, width, height), None)
+            if future.done():
+                self.prefetched += 1
+            else:
+                # waiting for the thread is quicker than scaling it all over again
+                self.waited += 1
+            return spec, DRAGON_SPRITES.add(facing, width, height, future.result())
+
+        if not DRAGON_SPRITES.is_ready(facing, width, height):
+            self.sync_fallbacks += 1
+        return spec, DRAGON_SPRITES.get(facing, width, height)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            'depth': len(self.queue),
+            'min_depth': self.min_depth,
+            'max_size': self.max_size,
+            'taken': self.taken,
+            'prefetched': self.prefetched,
+            'waited': self.waited,
+            'sync_fallbacks': self.sync_fallbacks}
+
+
+class ReplayDesyncError(Exception):
+    """Raised when a replayed game's state stops matching the recording."""
+
+
+class InputRecorder:
+    """Writes everything needed to play a game again to a small binary file: the seed
+    and settings the game started with, then one byte per frame holding the arrow keys
+    held and the way the player faced after that frame's events, plus how many
+    simulation steps the frame ran. Every checksum_every frames the game's
+    state_checksum() is written after the frame byte, so a replay can tell if it
+    stopped matching the recording.
+
+    File layout (little endian):
+        header   HEADER: magic, version, seed, sim_hz, checksum_every, settings length
+        settings JSON: {"backend": ..., "config": {...}}
+        frames   B per frame, then I after every checksum_every'th frame
+                 bit 0-3: move left, right, up, down; bit 4: facing right; bit 5-7: steps
+    """
+
+    MAGIC = b'BDIR'
+    VERSION = 1
+    HEADER = struct.Struct('<4sBQHHH')
+    CHECKSUM = struct.Struct('<I')
+
+    def __init__(self, path, game, checksum_every=REPLAYCHECKSUMEVERY):
+        self.checksum_every = checksum_every
+        self.frames = 0
+
+        settings = json.dumps({'backend': game.dragon_backend, 'config': game.config}).encode()
+        self.file = open(path, 'wb')
+        self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION, game.seed, SIMHZ, checksum_every,
+                                         len(settings)))
+        self.file.write(settings)
+
+    def record_frame(self, game, steps):
+        # called after the frame's simulation steps have run
+        if not 0 <= steps < 8:
+            raise ValueError('can only record frames of 0 to 7 simulation steps, not %s' % steps)
+
+        self.file.write(bytes((game.move_left | game.move_right << 1 | game.move_up << 2 | game.move_down << 3 |
+                               (game.player_obj.facing == RIGHT) << 4 | steps << 5,)))
+        self.frames += 1
+        if self.frames % self.checksum_every == 0:
+            self.file.write(self.CHECKSUM.pack(game.state_checksum()))
+
+    def close(self):
+        self.file.close()
+
+
+class InputReplayer:
+    """Reads a file written by InputRecorder and feeds it back into a game, frame by frame."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        header = InputRecorder.HEADER
+        magic, version, self.seed, sim_hz, self.checksum_every, settings_length = header.unpack_from(data)
+        if magic != InputRecorder.MAGIC or version != InputRecorder.VERSION:
+            raise ValueError('%s is not a Blueberry Dragon recording' % path)
+        if sim_hz != SIMHZ:
+            raise ValueError('%s was recorded at %s steps a second, not SIMHZ (%s)' % (path, sim_hz, SIMHZ))
+
+        settings = json.loads(data[header.size:header.size + settings_length].decode())
+        self.dragon_backend = settings['backend']
+        self.config = settings['config']
+
+        self.data = data
+        self.offset = header.size + settings_length
+        self.frames = 0
+        self.checksums_verified = 0
+
+    def make_game(self, render=False, profiler=None):
+        # Returns a new game set up the same way as the recorded one, with this replay attached
+        game = BDGame(dragon_backend=self.dragon_backend, seed=self.seed, render=render,
+                      profiler=profiler, config=self.config)
+        game.replay = self
+        return game
+
+    def done(self):
+        return self.offset >= len(self.data)
+
+    def apply_frame(self, game):
+        # Puts the recorded input for the next frame into the game and returns
+        # how many simulation steps the frame ran
+        bits = self.data[self.offset]
+        self.offset += 1
+
+        game.set_input(bool(bits & 1), bool(bits & 2), bool(bits & 4), bool(bits & 8))
+        game._set_facing(RIGHT if bits & 16 else LEFT)
+        return bits >> 5
+
+    def check_frame(self, game):
+        # called after the frame's simulation steps have run
+        self.frames += 1
+        if self.frames % self.checksum_every != 0:
+            return
+
+        checksum_size = InputRecorder.CHECKSUM.size
+        if self.offset + checksum_size > len(self.data):
+            # the recording was cut off before this checksum got written
+            self.offset = len(self.data)
+            return
+
+        expected, = InputRecorder.CHECKSUM.unpack_from(self.data, self.offset)
+        self.offset += checksum_size
+
+        checksum = game.state_checksum()
+        if checksum != expected:
+            raise ReplayDesyncError('replay diverged at frame %s (step %s): state checksum %s, recorded %s'
+                                    % (self.frames, game.step_count, checksum, expected))
+        self.checksums_verified += 1
+
+
 class BDGame:
     """SCREEN ATTRIBUTES"""
     FPS = 30  # frames per second to update the screen
@@ -82,229 +1493,571 @@ class BDGame:
     WHITE = (255, 255, 255)
     RED = (255, 0, 0)
 
-    """"""
-    CAMERASLACK = 90  # how far from the center the dragon moves before moving the camera
-    MOVERATE = 9  # how fast the player moves
-    BOUNCERATE = 6  # how fast the player bounces (large is slower)
-    BOUNCEHEIGHT = 30  # how high the player bounces
-    STARTSIZE = 25  # how big the player starts off
-    WINSIZE = 300  # how big the player needs to be to win
-    INVULNTIME = 2  # how long the player is invulnerable after being hit in seconds
-    GAMEOVERTIME = 4  # how long the "game over" text stays on the screen in seconds
-    MAXHEALTH = 3  # how much health the player starts with
-
-    NUM_ROCKS = 80  # number of rock objects in the active area
-    NUM_DRAGONS = 30  # number of dragons in the active area
-    DRAGONMINSPEED = 3  # slowest dragon speed
-    DRAGONMAXSPEED = 7  # fastest dragon speed
-    DIRCHANGEFREQ = 2  # % chance of direction change per frame
+    """TUNABLES"""
+    # these default to the module constants, BDGame(config={...}) overrides them per game
+    CAMERASLACK = CAMERASLACK
+    MOVERATE = MOVERATE
+    BOUNCERATE = BOUNCERATE
+    BOUNCEHEIGHT = BOUNCEHEIGHT
+    STARTSIZE = STARTSIZE
+    WINSIZE = WINSIZE
+    INVULNTIME = INVULNTIME
+    GAMEOVERTIME = GAMEOVERTIME
+    MAXHEALTH = MAXHEALTH
+
+    NUM_ROCKS = NUM_ROCKS
+    NUM_DRAGONS = NUM_DRAGONS
+    DRAGONMINSPEED = DRAGONMINSPEED
+    DRAGONMAXSPEED = DRAGONMAXSPEED
+    DIRCHANGEFREQ = DIRCHANGEFREQ
+    ECOSYSTEM = ECOSYSTEM
+    TUNABLES = ('CAMERASLACK', 'MOVERATE', 'BOUNCERATE', 'BOUNCEHEIGHT', 'STARTSIZE', 'WINSIZE', 'INVULNTIME',
+                'GAMEOVERTIME', 'MAXHEALTH', 'NUM_ROCKS', 'NUM_DRAGONS', 'DRAGONMINSPEED', 'DRAGONMAXSPEED',
+                'DIRCHANGEFREQ', 'ECOSYSTEM')
     LEFT = 'left'
     RIGHT = 'right'
 
-    def __init__(self):
+    def __init__(self, dragon_backend=DRAGONBACKEND, seed=None, render=True,
+                 profiler=None, dirty_rects=False, config=None, spawn_workers=SPAWNWORKERS, render_size=RENDERSIZE,
+                 gc_mode=GCMODE):
+        # config overrides any of the TUNABLES for this game only, like {'NUM_DRAGONS': 100}
+        for name, value in (config or {}).items():
+            if name not in self.TUNABLES:
+                raise ValueError('%r is not one of the BDGame tunables' % name)
+            setattr(self, name, value)
+
+        # kept so a recording can start an identical game
+        self.dragon_backend = dragon_backend
+        self.config = dict(config or {})
+
+        # every random choice the game makes comes from its own RNG, so a game
+        # started with the same seed and the same input always plays out the same
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.random = random.Random(self.seed)
+
+        # the simulation moves in fixed steps of 1 / SIMHZ seconds, no matter how often
+        # frames get drawn, and every game timer counts steps instead of reading the clock
+        self.step_count = 0
+        self.steps_last_frame = 0  # how many simulation steps ran for the last frame
+        self.skipped_renders = 0  # frames not drawn because the simulation had to catch up
+
+        # when render is False the game is simulated without drawing anything
+        self.render = render
+
+        # an optional FrameProfiler that times each stage of every frame
+        self.profiler = profiler
+
+        # in dirty rect mode the draw calls are queued up, and only the parts of the
+        # screen that changed since the last frame are redrawn and pushed to the display
+        self.dirty_rects = dirty_rects
+        self.draw_queue = []  # (surface, screen rect) for everything drawn this frame
+        self.background_blits = []  # (chunk surface, screen position) for the world chunks in view
+        self.dragon_blits = []  # (surface, screen position) of the enemy dragons in view, reused every frame
+        self.prev_drawn_rects = []  # where things were drawn last frame
+        self.prev_camera = None  # camera position last frame
+        self.visible_dragons = 0  # enemy dragons drawn last frame
+        self.culled_dragons = 0  # enemy dragons skipped last frame because they were out of view
+
+        # the game is drawn into `target` at render_size, which gets scaled to the window
+        # once a frame. At the window's own size it's drawn straight to the window.
+        self.render_size = tuple(render_size or (WINWIDTH, WINHEIGHT))
+        if not _has_window_shape(self.render_size):
+            # the world is drawn at one scale for both axes, so it has to fill the target exactly
+            raise ValueError('render size %sx%s is not the same shape as the %sx%s window' % (
+                self.render_size + (WINWIDTH, WINHEIGHT)))
+        if self.render_size == (WINWIDTH, WINHEIGHT):
+            self.target = DISPLAYSURF
+        else:
+            self.target = pygame.Surface(self.render_size).convert()
+
+        # the camera zooms out as the player grows, so the camera view covers more of the world
+        self.zoom = ZOOMLEVELS[0]
+        self.view_width = int(WINWIDTH / self.zoom)  # how much of the world the camera sees
+        self.view_height = int(WINHEIGHT / self.zoom)
+
+        # an optional InputRecorder that saves every frame's input, and an optional
+        # InputReplayer that replaces the keyboard with a recording
+        self.recorder = None
+        self.replay = None
+
         # set up variables for the start of a new game
+        self.meals = 0  # how many dragons the player has eaten
+        self.dragon_meals = 0  # how many dragons other dragons have eaten, in ECOSYSTEM mode
+        self.hits = 0  # how many times the player has been hurt
         self.invulnerable_mode = False  # if the player is invulnerable
         self.invulnerable_start_time = 0  # time the player became invulnerable
         self.game_over_mode = False  # if the player has lost
         self.game_over_start_time = 0  # time the player lost
         self.win_mode = False  # if the player has won
 
-        # create the surfaces to hold game text
-        self.game_over_surf = BASICFONT.render('Game Over', True, WHITE)
-        self.game_over_rect = self.game_over_surf.get_rect()
-        self.game_over_rect.center = (HALF_WINWIDTH, HALF_WINHEIGHT)
-
-        self.win_surf = BASICFONT.render('You have achieved OMEGA DRAGON!', True, WHITE)
-        self.win_rect = self.win_surf.get_rect()
-        self.win_rect.center = (HALF_WINWIDTH, HALF_WINHEIGHT)
-
-        self.win_surf2 = BASICFONT.render('(Press "r" to restart.)', True, WHITE)
-        self.win_rect2 = self.win_surf2.get_rect()
-        self.win_rect2.center = (HALF_WINWIDTH, HALF_WINHEIGHT + 30)
+        # the health meter for every amount of health the player can have
+        self.health_meter_surfs = [self._make_health_meter(health, self.MAXHEALTH)
+                                   for health in range(self.MAXHEALTH + 1)]
+        self.health_meter_rect = self.health_meter_surfs[0].get_rect(topleft=(15, 15))
 
         # camera_x and camera_y are the top left of where the camera view is
         self.camera_x = 0
         self.camera_y = 0
+        self.prev_camera_x = 0  # where the camera was one simulation step ago
+        self.prev_camera_y = 0
 
         # stores the player object:
-        self.player_obj = {
-            'surface': pygame.transform.scale(L_DRAGON_IMG, (STARTSIZE, STARTSIZE)),
-            'facing': LEFT,
-            'size': STARTSIZE,
-            'x': HALF_WINWIDTH,
-            'y': HALF_WINHEIGHT,
-            'bounce': 0,
-            'health': MAXHEALTH}
+        self.player_obj = Player(HALF_WINWIDTH, HALF_WINHEIGHT, self.STARTSIZE,
+                                 DRAGON_SPRITES.get(LEFT, self.STARTSIZE, self.STARTSIZE), LEFT, self.MAXHEALTH)
+        self.player_bounce_offsets = BOUNCETABLES[self.BOUNCERATE, self.BOUNCEHEIGHT]
+        self.dragon_rect = pygame.Rect(0, 0, 0, 0)  # moved onto each dragon the player is checked against
 
         self.move_left = False
         self.move_right = False
         self.move_up = False
         self.move_down = False
 
-        self.rock_objs = []  # stores all the grass objects in the game
-        self.dragon_objs = []  # stores all the non-player dragon objects
-
-        # start off with some random grass images on the screen
-        for i in range(10):
-            self.rock_objs.append(self._make_new_rock(self.camera_x, self.camera_y))
-            self.rock_objs[i]['x'] = random.randint(0, WINWIDTH)
-            self.rock_objs[i]['y'] = random.randint(0, WINHEIGHT)
-
-    def _make_new_dragon(self, camera_x, camera_y):
-        dragon = {}
-
-        general_size = random.randint(5, 25)
-        multiplier = random.randint(1, 3)
-
-        dragon['width'] = (general_size + random.randint(0, 10)) * multiplier
-        dragon['height'] = (general_size + random.randint(0, 10)) * multiplier
-
-        dragon['x'], dragon['y'] = self._get_random_off_camera_pos(camera_x, camera_y, dragon['width'], dragon['height'])
-
-        dragon['movex'] = self._get_random_velocity()
-        dragon['movey'] = self._get_random_velocity()
-
-        if dragon['movex'] < 0:  # squirrel is facing left
-            dragon['surface'] = pygame.transform.scale(L_DRAGON_IMG, (dragon['width'], dragon['height']))
-        else:  # squirrel is facing right
-            dragon['surface'] = pygame.transform.scale(R_DRAGON_IMG, (dragon['width'], dragon['height']))
-
-        dragon['bounce'] = 0
-
-        dragon['bouncerate'] = random.randint(10, 18)
-        dragon['bounceheight'] = random.randint(10, 50)
-
-        return dragon
-
-    def _make_new_rock(self, camera_x, camera_y):
-        gr = dict()
-
-        gr['grassImage'] = random.randint(0, len(GRASSIMAGES) - 1)
-        gr['width'] = GRASSIMAGES[0].get_width()
-        gr['height'] = GRASSIMAGES[0].get_height()
-        gr['x'], gr['y'] = self._get_random_off_camera_pos(camera_x, camera_y, gr['width'], gr['height'])
-        gr['rect'] = pygame.Rect((gr['x'], gr['y'], gr['width'], gr['height']))
+        # stores all the non-player dragon objects
+        if dragon_backend == 'numpy':
+            self.dragon_objs = DragonArrayStore(seed=self.random.getrandbits(64))
+            self.dragon_grid = None  # the array store answers area queries itself
+        else:
+            self.dragon_objs = []
+            self.dragon_grid = SpatialHash(MAXDRAGONSIZE)
+
+        # in ECOSYSTEM mode this finds the dragons that ran into each other. The array
+        # store does its own sweep.
+        self.dragon_sweep = SweepAndPrune() if self.ECOSYSTEM and dragon_backend != 'numpy' else None
+
+        # the grass and rocks, laid out from the world seed
+        rocks_per_chunk = self.NUM_ROCKS * CHUNKSIZE * CHUNKSIZE / float(WINWIDTH * 3 * WINHEIGHT * 3)
+        self.world = ChunkedWorld(self.random.getrandbits(32), GRASSIMAGES, rocks_per_chunk)
+
+        # new dragons are made ahead of time, with their sprites scaled on other threads
+        self.spawn_random = random.Random(self.random.getrandbits(32))
+        self.spawn_queue = SpawnQueue(self._make_dragon_spec, workers=spawn_workers)
+        self.spawn_queue.fill()
+
+        # 'freeze' puts everything that exists before play starts (images, tables, caches)
+        # out of the garbage collector's reach, so its collections have less to look at.
+        # 'defer' turns automatic collections off, and run_frame() collects once the frame
+        # is drawn instead, so a collection can't land in the middle of a frame.
+        self.gc_mode = gc_mode
+        if gc_mode == 'freeze':
+            if not hasattr(gc, 'freeze'):
+                raise ValueError('gc_mode \'freeze\' needs Python 3.7 or newer')
+            gc.unfreeze()  # whatever an earlier game left behind can be collected
+            gc.collect()
+            gc.freeze()
+        elif gc_mode == 'defer':
+            gc.disable()
+        elif gc_mode is not None:
+            raise ValueError('gc_mode has to be None, \'freeze\' or \'defer\', not %r' % gc_mode)
+
+    def _make_dragon_spec(self):
+        # Returns everything about a new dragon except where it is. These come from
+        # their own RNG, since the spawn queue makes them ahead of time.
+        rng = self.spawn_random
+        general_size = rng.randint(5, 25)
+        multiplier = rng.randint(1, 3)
+
+        width = (general_size + rng.randint(0, 10)) * multiplier
+        height = (general_size + rng.randint(0, 10)) * multiplier
+
+        movex = self._get_random_velocity(rng)
+        movey = self._get_random_velocity(rng)
+
+        bouncerate = rng.randint(10, 18)
+        bounceheight = rng.randint(10, 50)
+
+        return width, height, movex, movey, bouncerate, bounceheight
+
+    def _make_new_dragons(self, camera_x, camera_y, count):
+        # Returns `count` new dragons. All their specs and surfaces (already facing the way
+        # they move) come off the spawn queue first, then all their positions are picked in
+        # one go. Each dragon takes one random number (up to SPAWNTRIES in ECOSYSTEM mode)
+        # and at most one sprite resample, so a burst of spawns costs the same per dragon.
+        taken = [self.spawn_queue.take() for i in range(count)]
+        positions = self._get_random_off_camera_positions(camera_x, camera_y, [spec[:2] for spec, surface in taken])
+        dragons = [Dragon(x, y, width, height, movex, movey, surface, bouncerate, bounceheight)
+                   for ((width, height, movex, movey, bouncerate, bounceheight), surface), (x, y)
+                   in zip(taken, positions)]
+        if self.ECOSYSTEM:
+            self._spread_out_dragons(dragons, camera_x, camera_y)
+        return dragons
+
+    def _spread_out_dragons(self, dragons, camera_x, camera_y):
+        # A dragon spawned on top of another one eats it, or gets eaten, before it's even
+        # been seen. So in ECOSYSTEM mode the new dragons that landed on a dragon, old or
+        # new, get moved to other random spots, up to SPAWNTRIES spots in all. In a crowd
+        # with no room left, the last spot they tried is kept.
+        placed = SpatialHash(MAXDRAGONSIZE)  # the new dragons that have a spot to themselves
+        crowded = dragons
+        for attempt in range(SPAWNTRIES):
+            if attempt:
+                sizes = [(d_obj.width, d_obj.height) for d_obj in crowded]
+                for d_obj, (x, y) in zip(crowded, self._get_random_off_camera_positions(camera_x, camera_y, sizes)):
+                    d_obj.x = d_obj.prevx = x
+                    d_obj.y = d_obj.prevy = y
+
+            still_crowded = []
+            for d_obj in crowded:
+                left, top = d_obj.x, d_obj.y
+                right, bottom = left + d_obj.width, top + d_obj.height
+                if self.dragon_grid is None:
+                    nearby = self.dragon_objs.query(left, top, right, bottom)
+                else:
+                    nearby = self.dragon_grid.query(left, top, right, bottom)
+                if (_overlaps_any(nearby, left, top, right, bottom) or
+                        _overlaps_any(placed.query(left, top, right, bottom), left, top, right, bottom)):
+                    still_crowded.append(d_obj)
+                else:
+                    placed.insert(d_obj)
+            crowded = still_crowded
+            if not crowded:
+                break
 
-        return gr
+    def _get_time(self):
+        # Returns the game time in seconds, counted in simulation steps
+        return self.step_count / float(SIMHZ)
 
     def _check_invulnerable_mode(self):
         # Check if we should turn off invulnerability
-        if self.invulnerable_mode and time.time() - self.invulnerable_start_time > INVULNTIME:
+        if self.invulnerable_mode and self._get_time() - self.invulnerable_start_time > self.INVULNTIME:
             self.invulnerable_mode = False
 
     def _move_dragon_objs(self):
+        if isinstance(self.dragon_objs, DragonArrayStore):
+            self.dragon_objs.move(self.DIRCHANGEFREQ, self.DRAGONMINSPEED, self.DRAGONMAXSPEED)
+            return
+
         for d_obj in self.dragon_objs:
             # move the dragon, and adjust for their bounce
-            d_obj['x'] += d_obj['movex']
-            d_obj['y'] += d_obj['movey']
-            d_obj['bounce'] += 1
+            d_obj.prevx = d_obj.x
+            d_obj.prevy = d_obj.y
+            d_obj.x += d_obj.movex
+            d_obj.y += d_obj.movey
+            d_obj.bounce += 1
 
-            if d_obj['bounce'] > d_obj['bouncerate']:
+            if d_obj.bounce > d_obj.bouncerate:
                 # reset bounce amount
-                d_obj['bounce'] = 0
+                d_obj.bounce = 0
 
             # random chance they change direction
-            if random.randint(0, 99) < DIRCHANGEFREQ:
-                d_obj['movex'] = self._get_random_velocity()
-                d_obj['movey'] = self._get_random_velocity()
+            if self.random.randint(0, 99) < self.DIRCHANGEFREQ:
+                d_obj.movex = self._get_random_velocity()
+                d_obj.movey = self._get_random_velocity()
 
                 # faces right
-                if d_obj['movex'] > 0:
-                    d_obj['surface'] = pygame.transform.scale(R_DRAGON_IMG, (d_obj['width'], d_obj['height']))
+                if d_obj.movex > 0:
+                    d_obj.surface = DRAGON_SPRITES.get(RIGHT, d_obj.width, d_obj.height)
                 # faces left
                 else:
-                    d_obj['surface'] = pygame.transform.scale(L_DRAGON_IMG, (d_obj['width'], d_obj['height']))
+                    d_obj.surface = DRAGON_SPRITES.get(LEFT, d_obj.width, d_obj.height)
 
-    @staticmethod
-    def _get_random_velocity():
-        speed = random.randint(DRAGONMINSPEED, DRAGONMAXSPEED)
-        if random.randint(0, 1) == 0:
+            self.dragon_grid.update(d_obj)
+
+    def _get_random_velocity(self, rng=None):
+        rng = rng or self.random
+        speed = rng.randint(self.DRAGONMINSPEED, self.DRAGONMAXSPEED)
+        if rng.randint(0, 1) == 0:
             return speed
         else:
             return -speed
 
-    @staticmethod
-    def _is_outside_active_area(camera_x, camera_y, obj):
-        # Return False if camera_x and camera_y are more than
-        # a half-window length beyond the edge of the window.
-        bounds_left_edge = camera_x - WINWIDTH
-        bounds_top_edge = camera_y - WINHEIGHT
-        bounds_rect = pygame.Rect(bounds_left_edge, bounds_top_edge, WINWIDTH * 3, WINHEIGHT * 3)
-        obj_rect = pygame.Rect(obj['x'], obj['y'], obj['width'], obj['height'])
-        return not bounds_rect.colliderect(obj_rect)
-
-    def _delete_unused_objs(self, obj_list):
-        # go through all the objects and see if any need to be deleted.
-        for i in range(len(obj_list) - 1, -1, -1):
-            if self._is_outside_active_area(self.camera_x, self.camera_y, obj_list[i]):
-                del obj_list[i]
-
-    def _add_more_objs(self, obj_list, default_obj_size, obj_creation_func):
-        # add more grass & dragons if we don't have enough.
-        while len(obj_list) < default_obj_size:
-            obj_list.append(obj_creation_func(self.camera_x, self.camera_y))
+    def _delete_unused_objs(self, obj_list, grid):
+        # delete the objects that left the active area, a view's width and height beyond
+        # every edge of the camera view. The array store does it all at once, and the
+        # grid throws out whole cells that left the active area.
+        active_area = (self.camera_x - self.view_width, self.camera_y - self.view_height,
+                       self.view_width * 3, self.view_height * 3)
+        if isinstance(obj_list, DragonArrayStore):
+            obj_list.remove_outside(*active_area)
+            return
+
+        removed = grid.remove_outside(*active_area)
+        if removed:
+            removed_ids = {id(obj) for obj in removed}
+            obj_list[:] = [obj for obj in obj_list if id(obj) not in removed_ids]
+            if self.dragon_sweep is not None:
+                self.dragon_sweep.remove(removed)
+
+    def _add_more_objs(self, obj_list, default_obj_size, obj_creation_func, grid=None):
+        # add more dragons if we don't have enough, all of them in one batch, at the end
+        # of obj_list. obj_creation_func(camera_x, camera_y, count) returns the new objects.
+        # Returns how many were added.
+        missing = default_obj_size - len(obj_list)
+        if missing <= 0:
+            return 0
+
+        objs = obj_creation_func(self.camera_x, self.camera_y, missing)
+        obj_list.extend(objs)
+        if grid is not None:
+            for obj in objs:
+                grid.insert(obj)
+        if self.dragon_sweep is not None:
+            self.dragon_sweep.add(objs)
+
+        # get the next ones started while the rest of the frame runs
+        self.spawn_queue.fill()
+        return len(objs)
+
+    def _get_nearby_dragons(self, rect):
+        # Returns the dragons that might collide with the given world rect. A dragon
+        # is raised by its bounce, so look that much further down.
+        left = rect.left
+        top = rect.top
+        right = rect.right
+        bottom = rect.bottom + MAXBOUNCEHEIGHT
+
+        if self.dragon_grid is None:
+            return self.dragon_objs.query(left, top, right, bottom)
+        return self.dragon_grid.query(left, top, right, bottom)
+
+    def _remove_dragon(self, dragon_obj):
+        if self.dragon_grid is None:
+            del self.dragon_objs[dragon_obj.index]
+            return
+
+        self.dragon_grid.remove(dragon_obj)
+        if self.dragon_sweep is not None:
+            self.dragon_sweep.remove((dragon_obj,))
+        for i, d_obj in enumerate(self.dragon_objs):
+            if d_obj is dragon_obj:
+                del self.dragon_objs[i]
+                break
+
+    def _dragons_eat_dragons(self, spawned=0):
+        # In ECOSYSTEM mode, when two dragons run into each other the bigger one eats the
+        # smaller one and grows, by the same amount the player would. Dragons of the same
+        # size bump past each other. Enemy dragons never grow past MAXDRAGONSIZE, which the
+        # spatial hash and the collision queries rely on.
+        #
+        # The last `spawned` dragons were spawned this step. In a crowd some of them land
+        # on other dragons (see _spread_out_dragons), so they sit this step out.
+        if self.dragon_sweep is not None:
+            pairs = self.dragon_sweep.get_pairs()
+        else:
+            pairs = self.dragon_objs.get_overlapping_pairs()
+
+        eaten = {}  # id(dragon) -> dragon, for the dragons eaten this step
+        count = len(self.dragon_objs)
+        newborn = {id(self.dragon_objs[i]) for i in range(count - spawned, count)}
+        for d_obj, other in pairs:
+            if id(d_obj) in eaten or id(other) in eaten or id(d_obj) in newborn or id(other) in newborn:
+                continue
+
+            area = d_obj.width * d_obj.height
+            other_area = other.width * other.height
+            if area == other_area:
+                continue
+            eater, meal = (d_obj, other) if area > other_area else (other, d_obj)
+
+            growth = int((meal.width * meal.height) ** 0.2) + 1
+            eater.width = min(eater.width + growth, MAXDRAGONSIZE)
+            eater.height = min(eater.height + growth, MAXDRAGONSIZE)
+            eater.surface = DRAGON_SPRITES.get(RIGHT if eater.movex > 0 else LEFT, eater.width, eater.height)
+            eaten[id(meal)] = meal
+
+        if not eaten:
+            return
+        self.dragon_meals += len(eaten)
+
+        if self.dragon_grid is None:
+            # deleting from the back first, so moving the last row into a hole never moves an eaten one
+            for index in sorted((d_obj.index for d_obj in eaten.values()), reverse=True):
+                del self.dragon_objs[index]
+            return
+
+        for d_obj in eaten.values():
+            self.dragon_grid.remove(d_obj)
+        self.dragon_sweep.remove(eaten.values())
+        self.dragon_objs[:] = [d_obj for d_obj in self.dragon_objs if id(d_obj) not in eaten]
 
     def _adjust_player_camera(self):
-        player_center_x = self.player_obj['x'] + int(self.player_obj['size'] / 2)
-        player_center_y = self.player_obj['y'] + int(self.player_obj['size'] / 2)
-
-        if (self.camera_x + HALF_WINWIDTH) - player_center_x > CAMERASLACK:
-            self.camera_x = player_center_x + CAMERASLACK - HALF_WINWIDTH
-        elif player_center_x - (self.camera_x + HALF_WINWIDTH) > CAMERASLACK:
-            self.camera_x = player_center_x - CAMERASLACK - HALF_WINWIDTH
-        if (self.camera_y + HALF_WINHEIGHT) - player_center_y > CAMERASLACK:
-            self.camera_y = player_center_y + CAMERASLACK - HALF_WINHEIGHT
-        elif player_center_y - (self.camera_y + HALF_WINHEIGHT) > CAMERASLACK:
-            self.camera_y = player_center_y - CAMERASLACK - HALF_WINHEIGHT
-
-    def _draw_player_dragon(self):
+        # zoom out to the first zoom level that keeps the player small enough on screen
+        for zoom in ZOOMLEVELS:
+            if self.player_obj.size * zoom <= ZOOMPLAYERHEIGHT * WINHEIGHT:
+                break
+        if zoom != self.zoom:
+            view_width = int(WINWIDTH / zoom)
+            view_height = int(WINHEIGHT / zoom)
+
+            # keep the camera centered on the same spot, drawing in between steps included
+            shift_x = (self.view_width - view_width) // 2
+            shift_y = (self.view_height - view_height) // 2
+            self.camera_x += shift_x
+            self.camera_y += shift_y
+            self.prev_camera_x += shift_x
+            self.prev_camera_y += shift_y
+            self.zoom, self.view_width, self.view_height = zoom, view_width, view_height
+
+        half_view_width = self.view_width // 2
+        half_view_height = self.view_height // 2
+        player_center_x = self.player_obj.x + int(self.player_obj.size / 2)
+        player_center_y = self.player_obj.y + int(self.player_obj.size / 2)
+
+        if (self.camera_x + half_view_width) - player_center_x > self.CAMERASLACK:
+            self.camera_x = player_center_x + self.CAMERASLACK - half_view_width
+        elif player_center_x - (self.camera_x + half_view_width) > self.CAMERASLACK:
+            self.camera_x = player_center_x - self.CAMERASLACK - half_view_width
+        if (self.camera_y + half_view_height) - player_center_y > self.CAMERASLACK:
+            self.camera_y = player_center_y + self.CAMERASLACK - half_view_height
+        elif player_center_y - (self.camera_y + half_view_height) > self.CAMERASLACK:
+            self.camera_y = player_center_y - self.CAMERASLACK - half_view_height
+
+    def _update_player_bounds(self):
+        # work out what part of the world the player covers this step, bounce included,
+        # which is what collisions are checked against. The same Rect is moved every step.
+        player = self.player_obj
+        if player.rect is None:
+            player.rect = pygame.Rect(0, 0, 0, 0)
+        rect = player.rect
+        rect.x = player.x
+        rect.y = player.y - self.player_bounce_offsets[player.bounce]
+        rect.w = player.size
+        rect.h = player.size
+
+    def _get_draw_scale(self):
+        # Returns how many pixels of the render target a CHUNKSIZE stretch of the world
+        # takes up. Everything in the world is drawn at that scale so the chunks line up.
+        return int(round(CHUNKSIZE * self.zoom * self.render_size[0] / float(WINWIDTH)))
+
+    def _draw_player_dragon(self, camera_x, camera_y, alpha):
         # draw the player squirrel
-        flash_is_on = round(time.time(), 1) * 10 % 2 == 1
+        flash_is_on = round(self._get_time(), 1) * 10 % 2 == 1
 
         if not self.game_over_mode and not (self.invulnerable_mode and flash_is_on):
-            self.player_obj['rect'] = pygame.Rect((
-                self.player_obj['x'] - self.camera_x,
-                self.player_obj['y'] - self.camera_y - self._get_bounce_amount(
-                    self.player_obj['bounce'],
-                    BOUNCERATE,
-                    BOUNCEHEIGHT),
-                self.player_obj['size'],
-                self.player_obj['size']))
-
-            DISPLAYSURF.blit(self.player_obj['surface'], self.player_obj['rect'])
-
-    def _draw_dragons(self):
-        # draw the other dragons
-        for d_obj in self.dragon_objs:
-            d_obj['rect'] = pygame.Rect((
-                d_obj['x'] - self.camera_x,
-                d_obj['y'] - self.camera_y - self._get_bounce_amount(
-                    d_obj['bounce'],
-                    d_obj['bouncerate'],
-                    d_obj['bounceheight']),
-                d_obj['width'],
-                d_obj['height']))
-
-            DISPLAYSURF.blit(d_obj['surface'], d_obj['rect'])
-
-    def _draw_rocks(self):
-        for r_obj in self.rock_objs:
-            r_rect = pygame.Rect((
-                r_obj['x'] - self.camera_x,
-                r_obj['y'] - self.camera_y,
-                r_obj['width'],
-                r_obj['height']))
-
-            DISPLAYSURF.blit(GRASSIMAGES[r_obj['grassImage']], r_rect)
+            prev_x = self.player_obj.prevx
+            prev_y = self.player_obj.prevy
+            x = prev_x + int((self.player_obj.x - prev_x) * alpha)
+            y = (prev_y + int((self.player_obj.y - prev_y) * alpha) -
+                 self.player_bounce_offsets[self.player_obj.bounce])
+
+            pixels = self._get_draw_scale()
+            if pixels == CHUNKSIZE:
+                self._blit(self.player_obj.surface, (x - camera_x, y - camera_y))
+            else:
+                size = max(1, self.player_obj.size * pixels // CHUNKSIZE)
+                self._blit(ZOOMED_SPRITES.get(self.player_obj.facing, size, size), (
+                    x * pixels // CHUNKSIZE - camera_x * pixels // CHUNKSIZE,
+                    y * pixels // CHUNKSIZE - camera_y * pixels // CHUNKSIZE))
+
+    def _draw_dragons(self, camera_x, camera_y, alpha):
+        # draw the other dragons that are in the camera view, all in one batch
+        view_width, view_height = self.render_size
+        pixels = self._get_draw_scale()
+        if isinstance(self.dragon_objs, DragonArrayStore):
+            blits = self.dragon_objs.get_blits(camera_x, camera_y, alpha, view_width, view_height, pixels)
+        elif pixels == CHUNKSIZE:
+            blits = self.dragon_blits
+            del blits[:]
+            for d_obj in self.dragon_objs:
+                prev_x = d_obj.prevx
+                x = prev_x + int((d_obj.x - prev_x) * alpha) - camera_x
+                if x >= view_width or x + d_obj.width <= 0:
+                    continue
+
+                prev_y = d_obj.prevy
+                y = (prev_y + int((d_obj.y - prev_y) * alpha) - camera_y -
+                     BOUNCETABLES[d_obj.bouncerate, d_obj.bounceheight][d_obj.bounce])
+                if y >= view_height or y + d_obj.height <= 0:
+                    continue
+
+                blits.append((d_obj.surface, (x, y)))
+        else:
+            # zoomed out, so positions and sprites get scaled down. The scaled sprites
+            # come out of ZOOMED_SPRITES, so they don't push the full size ones out.
+            left = camera_x * pixels // CHUNKSIZE
+            top = camera_y * pixels // CHUNKSIZE
+            blits = self.dragon_blits
+            del blits[:]
+            for d_obj in self.dragon_objs:
+                prev_x = d_obj.prevx
+                x = (prev_x + int((d_obj.x - prev_x) * alpha)) * pixels // CHUNKSIZE - left
+                width = max(1, d_obj.width * pixels // CHUNKSIZE)
+                if x >= view_width or x + width <= 0:
+                    continue
+
+                prev_y = d_obj.prevy
+                y = (prev_y + int((d_obj.y - prev_y) * alpha) -
+                     BOUNCETABLES[d_obj.bouncerate, d_obj.bounceheight][d_obj.bounce]) * pixels // CHUNKSIZE - top
+                height = max(1, d_obj.height * pixels // CHUNKSIZE)
+                if y >= view_height or y + height <= 0:
+                    continue
+
+                blits.append((ZOOMED_SPRITES.get(RIGHT if d_obj.movex > 0 else LEFT, width, height), (x, y)))
+
+        self.visible_dragons = len(blits)
+        self.culled_dragons = len(self.dragon_objs) - len(blits)
+        self._blit_layer(blits)
+
+    def _draw_rocks(self, camera_x, camera_y):
+        # draw the grass and rocks, a whole pre-rendered chunk at a time
+        blits = self.world.get_blits(camera_x, camera_y, self.render_size[0], self.render_size[1],
+                                     self._get_draw_scale())
+        if self.dirty_rects:
+            self.background_blits = blits
+        else:
+            self.target.blits(blits, False)
 
     def _draw_health_meter(self):
+        self._blit(self.health_meter_surfs[self.player_obj.health], self.health_meter_rect)
+
+    @staticmethod
+    def _make_health_meter(health, max_health):
+        surf = pygame.Surface((20, 10 * max_health), SRCALPHA)
+
         # draw red health bars
-        for i in range(self.player_obj['health']):
-            pygame.draw.rect(DISPLAYSURF, RED, (15, 5 + (10 * MAXHEALTH) - i * 10, 20, 10))
+        for i in range(health):
+            pygame.draw.rect(surf, RED, (0, 10 * (max_health - 1) - i * 10, 20, 10))
 
         # draw the white outlines
-        for i in range(MAXHEALTH):
-            pygame.draw.rect(DISPLAYSURF, WHITE, (15, 5 + (10 * MAXHEALTH) - i * 10, 20, 10), 1)
+        for i in range(max_health):
+            pygame.draw.rect(surf, WHITE, (0, 10 * (max_health - 1) - i * 10, 20, 10), 1)
+
+        return surf
+
+    def _blit(self, surface, rect):
+        if self.dirty_rects:
+            # blit only uses the top left of rect, the surface decides how much gets covered
+            self.draw_queue.append((surface, surface.get_rect(topleft=rect[:2])))
+        else:
+            self.target.blit(surface, rect)
+
+    def _blit_layer(self, blits):
+        # draw a list of (surface, position) with a single Surface.blits() call
+        if self.dirty_rects:
+            self.draw_queue.extend((surface, surface.get_rect(topleft=dest[:2])) for surface, dest in blits)
+        else:
+            self.target.blits(blits, False)
+
+    def _compose_dirty_rects(self, camera, full_redraw=False):
+        # Draws this frame's queued blits and returns the screen rects that changed,
+        # or None if the whole screen was redrawn. If the camera hasn't moved, every
+        # area drawn last frame or this frame is cleared and has the sprites overlapping
+        # it redrawn in their original order; the rest of the screen is left alone.
+        full_redraw = full_redraw or camera != self.prev_camera
+        self.prev_camera = camera
+
+        screen_rect = self.target.get_rect()
+        queue = [(surf, rect) for surf, rect in self.draw_queue if screen_rect.colliderect(rect)]
+        queue_rects = [rect for surf, rect in queue]
+        self.draw_queue = []
+
+        if full_redraw:
+            # the whole view scrolled, so everything on screen changed anyway
+            self.target.blits(self.background_blits, False)
+            self.target.blits(queue, False)
+            self.prev_drawn_rects = queue_rects
+            return None
+
+        dirty = [rect.clip(screen_rect) for rect in self.prev_drawn_rects + queue_rects]
+        for area in dirty:
+            # the clip keeps the background chunks from being copied outside of area
+            self.target.set_clip(area)
+            self.target.blits(self.background_blits, False)
+            for i in area.collidelistall(queue_rects):
+                self.target.blit(*queue[i])
+        self.target.set_clip(None)
+
+        self.prev_drawn_rects = queue_rects
+        return dirty
 
     def _handle_pygame_events(self):
         # TODO: Handle events in separate class
@@ -314,118 +2067,154 @@ class BDGame:
                 self.terminate()
 
             elif event.type == KEYDOWN:
-                if event.key in (K_UP, K_w):
-                    self.move_down = False
-                    self.move_up = True
-
-                elif event.key in (K_DOWN, K_s):
-                    self.move_up = False
-                    self.move_down = True
+                self._handle_key_down(event.key)
 
-                elif event.key in (K_LEFT, K_a):
-                    self.move_right = False
-                    self.move_left = True
+            elif event.type == KEYUP:
+                self._handle_key_up(event.key)
 
-                    # change player image
-                    if self.player_obj['facing'] != LEFT:
-                        self.player_obj['surface'] = pygame.transform.scale(
-                            L_DRAGON_IMG,
-                            (self.player_obj['size'], self.player_obj['size']))
+    def _handle_key_down(self, key):
+        if key in (K_UP, K_w):
+            self.move_down = False
+            self.move_up = True
 
-                    self.player_obj['facing'] = LEFT
+        elif key in (K_DOWN, K_s):
+            self.move_up = False
+            self.move_down = True
 
-                elif event.key in (K_RIGHT, K_d):
-                    self.move_left = False
-                    self.move_right = True
+        elif key in (K_LEFT, K_a):
+            self.move_right = False
+            self.move_left = True
+            self._set_facing(LEFT)
 
-                    # change player image
-                    if self.player_obj['facing'] != RIGHT:
-                        self.player_obj['surface'] = pygame.transform.scale(
-                            R_DRAGON_IMG,
-                            (self.player_obj['size'], self.player_obj['size']))
+        elif key in (K_RIGHT, K_d):
+            self.move_left = False
+            self.move_right = True
+            self._set_facing(RIGHT)
 
-                    self.player_obj['facing'] = RIGHT
+        elif self.win_mode and key == K_r:
+            return
 
-                elif self.win_mode and event.key == K_r:
-                    return
+        elif key == K_F3 and self.profiler is not None:
+            # show or hide the stage timings
+            self.profiler.overlay_visible = not self.profiler.overlay_visible
+
+    def _set_facing(self, facing):
+        # change player image
+        if self.player_obj.facing != facing:
+            self.player_obj.surface = DRAGON_SPRITES.get(
+                facing,
+                self.player_obj.size,
+                self.player_obj.size)
+
+        self.player_obj.facing = facing
+
+    def _handle_key_up(self, key):
+        # stop moving the player's dragon
+        if key in (K_LEFT, K_a):
+            self.move_left = False
+        elif key in (K_RIGHT, K_d):
+            self.move_right = False
+        elif key in (K_UP, K_w):
+            self.move_up = False
+        elif key in (K_DOWN, K_s):
+            self.move_down = False
+
+        elif key == K_ESCAPE:
+            self.terminate()
+
+    def set_input(self, left, right, up, down):
+        # hold down exactly the given arrow keys, pressing and releasing them as needed
+        for key, hold, held in ((K_LEFT, left, self.move_left), (K_RIGHT, right, self.move_right),
+                                (K_UP, up, self.move_up), (K_DOWN, down, self.move_down)):
+            if hold and not held:
+                self._handle_key_down(key)
+            elif held and not hold:
+                self._handle_key_up(key)
+
+    def terminate(self):
+        if self.profiler is not None and self.profiler.dump_path:
+            self.profiler.dump(self.profiler.dump_path)
+        if self.recorder is not None:
+            self.recorder.close()
+        self.spawn_queue.close()
+        if self.gc_mode == 'defer':
+            gc.enable()
 
-            elif event.type == KEYUP:
-                # stop moving the player's dragon
-                if event.key in (K_LEFT, K_a):
-                    self.move_left = False
-                elif event.key in (K_RIGHT, K_d):
-                    self.move_right = False
-                elif event.key in (K_UP, K_w):
-                    self.move_up = False
-                elif event.key in (K_DOWN, K_s):
-                    self.move_down = False
-
-                elif event.key == K_ESCAPE:
-                    self.terminate()
-
-    @staticmethod
-    def terminate():
         pygame.quit()
         sys.exit()
 
     def _move_player(self):
         # actually move the player
         if self.move_left:
-            self.player_obj['x'] -= MOVERATE
+            self.player_obj.x -= self.MOVERATE
         if self.move_right:
-            self.player_obj['x'] += MOVERATE
+            self.player_obj.x += self.MOVERATE
         if self.move_up:
-            self.player_obj['y'] -= MOVERATE
+            self.player_obj.y -= self.MOVERATE
         if self.move_down:
-            self.player_obj['y'] += MOVERATE
+            self.player_obj.y += self.MOVERATE
 
-        if (self.move_left or self.move_right or self.move_up or self.move_down) or self.player_obj['bounce'] != 0:
-            self.player_obj['bounce'] += 1
+        if (self.move_left or self.move_right or self.move_up or self.move_down) or self.player_obj.bounce != 0:
+            self.player_obj.bounce += 1
 
-        if self.player_obj['bounce'] > BOUNCERATE:
+        if self.player_obj.bounce > self.BOUNCERATE:
             # reset bounce amount
-            self.player_obj['bounce'] = 0
-
-        # check if the player has collided with any dragons
-        for i in range(len(self.dragon_objs) - 1, -1, -1):
-            dragon_obj = self.dragon_objs[i]
-            if 'rect' in dragon_obj and self.player_obj['rect'].colliderect(dragon_obj['rect']):
+            self.player_obj.bounce = 0
+
+        # check if the player has collided with any of the dragons near it
+        player_rect = self.player_obj.rect
+        dragon_rect = self.dragon_rect
+        size_before_meals = self.player_obj.size
+        for dragon_obj in self._get_nearby_dragons(player_rect):
+            dragon_rect.x = dragon_obj.x
+            dragon_rect.y = (dragon_obj.y -
+                             BOUNCETABLES[dragon_obj.bouncerate, dragon_obj.bounceheight][dragon_obj.bounce])
+            dragon_rect.w = dragon_obj.width
+            dragon_rect.h = dragon_obj.height
+            if player_rect.colliderect(dragon_rect):
 
                 # a player/dragon collision has occurred
-                if dragon_obj['width'] * dragon_obj['height'] <= self.player_obj['size'] ** 2:
+                if dragon_obj.width * dragon_obj.height <= self.player_obj.size ** 2:
                     # player is larger and eats the dragon
-                    self.player_obj['size'] += int((dragon_obj['width'] * dragon_obj['height']) ** 0.2) + 1
-                    del self.dragon_objs[i]
-
-                    # set dragon image to be what direction they are going!
-                    facing_image = L_DRAGON_IMG if self.player_obj['facing'] == LEFT else R_DRAGON_IMG
-                    self.player_obj['surface'] = pygame.transform.scale(
-                        facing_image,
-                        (self.player_obj['size'], self.player_obj['size']))
+                    self.player_obj.size += int((dragon_obj.width * dragon_obj.height) ** 0.2) + 1
+                    self._remove_dragon(dragon_obj)
+                    self.meals += 1
 
-                    if self.player_obj['size'] > WINSIZE:
+                    if self.player_obj.size > self.WINSIZE:
                         # turn on "win mode"
                         self.win_mode = True
 
                 elif not self.invulnerable_mode:
                     # player is smaller and takes damage
                     self.invulnerable_mode = True
-                    self.invulnerable_start_time = time.time()
-                    self.player_obj['health'] -= 1
-                    if self.player_obj['health'] == 0:
+                    self.invulnerable_start_time = self._get_time()
+                    self.hits += 1
+                    self.player_obj.health -= 1
+                    if self.player_obj.health == 0:
                         self.game_over_mode = True  # turn on "game over mode"
-                        self.game_over_start_time = time.time()
+                        self.game_over_start_time = self._get_time()
+
+        if self.player_obj.size != size_before_meals:
+            # set dragon image to be what direction they are going! Only the size it ends
+            # the step at is scaled, however many dragons it ate.
+            self.player_obj.surface = DRAGON_SPRITES.get(self.player_obj.facing, self.player_obj.size,
+                                                         self.player_obj.size)
+
+    def _show_text(self, text, offset_y=0):
+        # draw one of the TEXTS centered on the screen
+        text_surf = get_text_surface(text)
+        self._blit(text_surf, text_surf.get_rect(center=self.target.get_rect().move(0, offset_y).center))
 
     def _show_game_over_text(self):
         # game is over, show "game over" text
-        DISPLAYSURF.blit(self.game_over_surf, self.game_over_rect)
-        if time.time() - self.game_over_start_time > GAMEOVERTIME:
+        self._show_text('Game Over')
+        if self._get_time() - self.game_over_start_time > self.GAMEOVERTIME:
             # end the current game
             return
 
     def _show_win_text(self):
-        DISPLAYSURF.blit(self.win_surf, self.win_rect)
-        DISPLAYSURF.blit(self.win_surf2, self.win_rect2)
+        self._show_text('You have achieved OMEGA DRAGON!')
+        self._show_text('(Press "r" to restart.)', 30)
 
     @staticmethod
     def _get_bounce_amount(current_bounce, bounce_rate, bounce_height):
@@ -435,83 +2224,487 @@ class BDGame:
         # current_bounce will always be less than bounce_rate
         return int(math.sin((math.pi / float(bounce_rate)) * current_bounce) * bounce_height)
 
-    @staticmethod
-    def _get_random_off_camera_pos(camera_x, camera_y, obj_width, obj_height):
-        # create a Rect of the camera view
-        camera_rect = pygame.Rect(camera_x, camera_y, WINWIDTH, WINHEIGHT)
-        while True:
-            x = random.randint(camera_x - WINWIDTH, camera_x + (2 * WINWIDTH))
-            y = random.randint(camera_y - WINHEIGHT, camera_y + (2 * WINHEIGHT))
+    def _get_random_off_camera_positions(self, camera_x, camera_y, sizes):
+        # Returns a random top left corner in the active area for each (width, height) in
+        # sizes, that keeps an object of that size entirely out of the camera view. One
+        # random number picks each spot straight out of the ring of such corners, so
+        # there's nothing to retry.
+        randrange = self.random.randrange
+        view_width = self.view_width
+        view_height = self.view_height
+        positions = []
+        for obj_width, obj_height in sizes:
+            total, regions = SPAWNRINGS[obj_width, obj_height, view_width, view_height]
+            spot = randrange(total)
+            for start, end, x, y, width in regions:
+                if spot < end:
+                    spot -= start
+                    positions.append((camera_x + x + spot % width, camera_y + y + spot // width))
+                    break
+        return positions
+
+    def state_checksum(self):
+        # Returns a CRC of everything the simulation depends on. Two games started
+        # with the same seed and fed the same input have the same checksum every frame.
+        state = [self.step_count, self.camera_x, self.camera_y, self.invulnerable_mode,
+                 self.game_over_mode, self.win_mode, self.player_obj.x, self.player_obj.y,
+                 self.player_obj.size, self.player_obj.bounce, self.player_obj.health]
+        for d_obj in self.dragon_objs:
+            state.extend((d_obj.x, d_obj.y, d_obj.width, d_obj.height, d_obj.movex,
+                          d_obj.movey, d_obj.bounce, d_obj.bouncerate, d_obj.bounceheight))
+        return zlib.crc32(repr(state).encode())
+
+    def _update(self):
+        # advance the simulation by one fixed step
+        profiler = self.profiler
+
+        self.prev_camera_x = self.camera_x
+        self.prev_camera_y = self.camera_y
+        self.player_obj.prevx = self.player_obj.x
+        self.player_obj.prevy = self.player_obj.y
+
+        self._check_invulnerable_mode()
+        if profiler is not None:
+            profiler.mark('invulnerable')
+
+        self._move_dragon_objs()
+        if profiler is not None:
+            profiler.mark('move_dragons')
+
+        self._delete_unused_objs(self.dragon_objs, self.dragon_grid)
+        if profiler is not None:
+            profiler.mark('delete_unused')
+
+        # add more dragons if we dont have enough
+        spawned = self._add_more_objs(self.dragon_objs, self.NUM_DRAGONS, self._make_new_dragons, self.dragon_grid)
+        if profiler is not None:
+            profiler.mark('add_more')
+
+        if self.ECOSYSTEM:
+            self._dragons_eat_dragons(spawned)
+            if profiler is not None:
+                profiler.mark('predation')
+
+        self._adjust_player_camera()
+        if profiler is not None:
+            profiler.mark('camera')
+
+        if not self.game_over_mode:
+            self._update_player_bounds()
+            self._move_player()
+        if profiler is not None:
+            profiler.mark('move_player')
+
+        self.step_count += 1
+
+    def _draw(self, alpha):
+        # draw the game `alpha` of the way from the previous simulation step to the latest one
+        profiler = self.profiler
+
+        camera_x = self.prev_camera_x + int((self.camera_x - self.prev_camera_x) * alpha)
+        camera_y = self.prev_camera_y + int((self.camera_y - self.prev_camera_y) * alpha)
+
+        # draw the grass and rocks background
+        self._draw_rocks(camera_x, camera_y)
+        if profiler is not None:
+            profiler.mark('draw_rocks')
+
+        self._draw_dragons(camera_x, camera_y, alpha)
+        if profiler is not None:
+            profiler.mark('draw_dragons')
+
+        self._draw_player_dragon(camera_x, camera_y, alpha)
+        if profiler is not None:
+            profiler.mark('draw_player')
+
+        # draw the health meter
+        self._draw_health_meter()
+
+        if self.game_over_mode:
+            self._show_game_over_text()
+
+        # check if the player has won
+        if self.win_mode:
+            self._show_win_text()
+        if profiler is not None:
+            profiler.mark('draw_health')
+
+        overlay_visible = profiler is not None and profiler.overlay_visible
+
+        update_rects = None
+        if self.dirty_rects:
+            # the overlay isn't tracked, so it gets a full redraw underneath it
+            update_rects = self._compose_dirty_rects((camera_x, camera_y, self.zoom), full_redraw=overlay_visible)
+            if profiler is not None:
+                profiler.mark('compose')
+
+        if self.target is not DISPLAYSURF:
+            # one scale of the whole frame up to the window
+            scale = pygame.transform.smoothscale if SMOOTHSCALE else pygame.transform.scale
+            scale(self.target, DISPLAYSURF.get_size(), DISPLAYSURF)
+            update_rects = None
+            if profiler is not None:
+                profiler.mark('scale')
+
+        if overlay_visible:
+            profiler.draw_overlay(DISPLAYSURF)
+            profiler.mark('overlay')
+
+        if update_rects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(update_rects)
+        if profiler is not None:
+            profiler.mark('display_update')
+
+    def run_frame(self, steps=1, alpha=1.0):
+        # Plays a single frame of the game: handles input, advances the simulation
+        # `steps` fixed steps and draws the game `alpha` of the way past the second
+        # to last step.
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start_frame()
+
+        self._handle_pygame_events()
+        if self.replay is not None:
+            # the recorded input replaces the keyboard, and the frame runs as many steps as it did
+            steps = self.replay.apply_frame(self)
+        if profiler is not None:
+            profiler.mark('events')
+
+        for i in range(steps):
+            self._update()
+
+        if self.recorder is not None:
+            self.recorder.record_frame(self, steps)
+        if self.replay is not None:
+            self.replay.check_frame(self)
+
+        self.steps_last_frame = steps
+        if steps > 1:
+            self.skipped_renders += steps - 1
+
+        if self.render:
+            self._draw(alpha)
+
+        if self.gc_mode == 'defer':
+            self._collect_deferred_garbage()
+            if profiler is not None:
+                profiler.mark('gc')
+
+        if profiler is not None:
+            profiler.end_frame()
 
-            # create a Rect object with the random coordinates and use colliderect()
-            # to make sure the right edge isn't in the camera view.
-            obj_rect = pygame.Rect(x, y, obj_width, obj_height)
-            if not obj_rect.colliderect(camera_rect):
-                return x, y
+    @staticmethod
+    def _collect_deferred_garbage():
+        # with automatic collection off, collect the generation it would have collected by now
+        count0, count1, count2 = gc.get_count()
+        threshold0, threshold1, threshold2 = gc.get_threshold()
+        if count0 < threshold0:
+            return
+        if count1 < threshold1:
+            gc.collect(0)
+        elif count2 < threshold2:
+            gc.collect(1)
+        else:
+            gc.collect(2)
 
     def run_game(self):
+        step_time = 1.0 / SIMHZ
+        accumulator = 0.0  # time that has passed but hasn't been simulated yet
+        last_time = time.perf_counter()
 
         # main game loop
         while True:
-            self._check_invulnerable_mode()
-            self._move_dragon_objs()
+            now = time.perf_counter()
+            accumulator += now - last_time
+            last_time = now
+
+            # run as many steps as the time that passed calls for, so a slow machine
+            # draws fewer frames instead of slowing the game down
+            steps = int(accumulator / step_time)
+            if steps > MAXSTEPSPERFRAME:
+                # too far behind to catch up, drop the time we can't make up
+                steps = MAXSTEPSPERFRAME
+                accumulator = steps * step_time
+            accumulator -= steps * step_time
+
+            self.run_frame(steps, accumulator / step_time)
+            FPSCLOCK.tick(FPS)
 
-            self._delete_unused_objs(self.rock_objs)
-            self._delete_unused_objs(self.dragon_objs)
 
-            # add more rocks and dragons if we dont have enough
-            self._add_more_objs(self.rock_objs, NUM_ROCKS, self._make_new_rock)
-            self._add_more_objs(self.dragon_objs, NUM_DRAGONS, self._make_new_dragon)
+FONTS = {}
+TEXTSURFS = {}
 
-            self._adjust_player_camera()
 
-            # draw the green background
-            DISPLAYSURF.fill(GRASSCOLOR)
+def get_font(size=32):
+    # fonts are only loaded the first time some text gets drawn
+    font = FONTS.get(size)
+    if font is None:
+        pygame.font.init()
+        font = FONTS[size] = pygame.font.Font('freesansbold.ttf', size)
+    return font
 
-            self._draw_dragons()
-            self._draw_rocks()
 
-            self._draw_player_dragon()
+def get_text_surface(text):
+    # Returns text rendered in white, out of the asset bundle if it's in there
+    text_surf = TEXTSURFS.get(text)
+    if text_surf is None:
+        if ASSETS is not None and 'text:' + text in ASSETS:
+            text_surf = ASSETS.get_surface('text:' + text)
+        else:
+            text_surf = get_font().render(text, True, WHITE)
+        TEXTSURFS[text] = text_surf
+    return text_surf
 
-            # draw the health meter
-            self._draw_health_meter()
 
-            self._handle_pygame_events()
+def _load_images():
+    # load the image files, converted to the display's pixel format once
+    # so blitting them doesn't have to convert every pixel every frame
+    right_img = pygame.image.load(os.path.join(IMAGEDIR, 'blueberry-dragon.png')).convert_alpha()
+    left_img = pygame.transform.flip(right_img, True, False)
+    grass_images = [pygame.image.load(os.path.join(IMAGEDIR, 'rock%s.png' % i)).convert_alpha()
+                    for i in range(1, 4)]
+    return right_img, left_img, grass_images
 
-            if not self.game_over_mode:
-                self._move_player()
-            else:
-                self._show_game_over_text()
 
-            # check if the player has won
-            if self.win_mode:
-                self._show_win_text()
+ASSETS = None
 
-            pygame.display.update()
-            FPSCLOCK.tick(FPS)
 
+def init_resources(headless=False, asset_bundle=ASSETBUNDLE):
+    global FPSCLOCK, DISPLAYSURF, ASSETS, L_DRAGON_IMG, R_DRAGON_IMG, GRASSIMAGES, DRAGON_SPRITES, ZOOMED_SPRITES
 
-def main():
-    global FPSCLOCK, DISPLAYSURF, BASICFONT, L_DRAGON_IMG, R_DRAGON_IMG, GRASSIMAGES
+    if headless:
+        # SDL's dummy driver gives us a display surface without opening a window
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
 
-    pygame.init()
+    # only the display is set up here, the font module waits for get_font()
+    pygame.display.init()
 
     FPSCLOCK = pygame.time.Clock()
     DISPLAYSURF = pygame.display.set_mode((WINWIDTH, WINHEIGHT))
-    BASICFONT = pygame.font.Font('freesansbold.ttf', 32)
 
-    pygame.display.set_icon(pygame.image.load('./images/gameicon.png'))
-    pygame.display.set_caption('Blueberry Dragon Eat Blueberry Dragon')
+    if not headless:
+        pygame.display.set_icon(pygame.image.load(os.path.join(IMAGEDIR, 'gameicon.png')))
+        pygame.display.set_caption('Blueberry Dragon Eat Blueberry Dragon')
+
+    if ASSETS is not None:
+        ASSETS.close()
+    TEXTSURFS.clear()
+    ASSETS = AssetBundle.load(asset_bundle) if asset_bundle else None
+    if ASSETS is not None:
+        BOUNCETABLES.update(ASSETS.bounce_tables)
+
+    # bounce offsets for every bounce rate and height an enemy dragon can have
+    for bounce_rate in range(10, 19):
+        for bounce_height in range(10, 51):
+            BOUNCETABLES[bounce_rate, bounce_height]
+
+    if ASSETS is not None:
+        R_DRAGON_IMG = ASSETS.get_surface('dragon-right')
+        L_DRAGON_IMG = ASSETS.get_surface('dragon-left')
+        GRASSIMAGES = [ASSETS.get_surface('rock%s' % i) for i in range(1, 4)]
+    else:
+        # decode the PNGs, and save a bundle for next time
+        R_DRAGON_IMG, L_DRAGON_IMG, GRASSIMAGES = _load_images()
+        if asset_bundle:
+            ASSETS = AssetBundle.build(asset_bundle, R_DRAGON_IMG, L_DRAGON_IMG, GRASSIMAGES)
+
+    # every scaled dragon surface in the game comes out of this cache
+    DRAGON_SPRITES = SpriteCache(L_DRAGON_IMG, R_DRAGON_IMG, bundle=ASSETS)
+    if PREWARMSPRITES:
+        DRAGON_SPRITES.prewarm(possible_dragon_sizes())
+    # the smaller sizes drawn while the camera is zoomed out
+    ZOOMED_SPRITES = SpriteCache(L_DRAGON_IMG, R_DRAGON_IMG, max_bytes=ZOOMSPRITECACHEBYTES, bundle=ASSETS)
+
+
+def _percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    return sorted_values[index]
+
+
+def run_benchmark(frames=1000, seed=0, render=True, dragon_backend=DRAGONBACKEND, profile_path=None,
+                  dirty_rects=False, record_path=None, render_size=RENDERSIZE, config=None, alloc_profile_path=None,
+                  gc_mode=GCMODE):
+    # Plays the given number of frames headless, as fast as possible, with the player
+    # steered by a scripted random walk. Returns throughput, per-frame time percentiles
+    # and the final state checksum, which only depends on the seed.
+    init_resources(headless=True)
+    if alloc_profile_path:
+        profiler = AllocationProfiler(capacity=frames)
+    else:
+        profiler = FrameProfiler(capacity=frames) if profile_path else None
+    game = BDGame(dragon_backend=dragon_backend, seed=seed, render=render, profiler=profiler,
+                  dirty_rects=dirty_rects, render_size=render_size, config=config, gc_mode=gc_mode)
+    gc_collections = [stat['collections'] for stat in gc.get_stats()]
+    if record_path:
+        game.recorder = InputRecorder(record_path, game)
+
+    script = random.Random(seed)
+    held_key = None
+    frame_times = []
+    visible_dragons = 0
+    culled_dragons = 0
+
+    start_time = time.perf_counter()
+    for frame in range(frames):
+        # hold a new arrow key every half second of game time
+        if frame % (FPS // 2) == 0:
+            if held_key is not None:
+                game._handle_key_up(held_key)
+            held_key = script.choice((K_LEFT, K_RIGHT, K_UP, K_DOWN))
+            game._handle_key_down(held_key)
+
+        frame_start_time = time.perf_counter()
+        game.run_frame()
+        frame_times.append(time.perf_counter() - frame_start_time)
+        visible_dragons += game.visible_dragons
+        culled_dragons += game.culled_dragons
+    total_time = time.perf_counter() - start_time
+
+    gc_collections = [stat['collections'] - before for stat, before in zip(gc.get_stats(), gc_collections)]
+    if profile_path:
+        profiler.dump(profile_path)
+    if alloc_profile_path:
+        profiler.dump(alloc_profile_path)
+        profiler.close()
+    if game.recorder is not None:
+        game.recorder.close()
+    if gc_mode == 'defer':
+        gc.enable()
+
+    frame_times.sort()
+    return {
+        'frames': frames,
+        'seed': seed,
+        'render': render,
+        'dragon_backend': dragon_backend,
+        'dirty_rects': dirty_rects,
+        'render_size': '%sx%s' % game.render_size,
+        'zoom': game.zoom,
+        'seconds': total_time,
+        'fps': frames / total_time,
+        'p50_ms': _percentile(frame_times, 50) * 1000,
+        'p90_ms': _percentile(frame_times, 90) * 1000,
+        'p99_ms': _percentile(frame_times, 99) * 1000,
+        'max_ms': frame_times[-1] * 1000,
+        'avg_visible': visible_dragons / float(frames),
+        'avg_culled': culled_dragons / float(frames),
+        'dragon_meals': game.dragon_meals,
+        'gc_mode': gc_mode,
+        'gc_collections': '/'.join(str(count) for count in gc_collections),
+        'spawn_prefetched': game.spawn_queue.prefetched,
+        'spawn_waited': game.spawn_queue.waited,
+        'spawn_sync_fallbacks': game.spawn_queue.sync_fallbacks,
+        'spawn_queue_min_depth': game.spawn_queue.min_depth,
+        'sprite_cache': _format_cache_stats(DRAGON_SPRITES.stats()),
+        'zoom_sprite_cache': _format_cache_stats(ZOOMED_SPRITES.stats()),
+        'chunk_cache': _format_cache_stats(game.world.stats()),
+        'checksum': game.state_checksum()}
+
+
+def _format_cache_stats(stats):
+    return '%s hits, %s misses, %s evictions, %.1f of %.1f MB' % (
+        stats['hits'], stats['misses'], stats['evictions'], stats['bytes'] / (1024.0 * 1024.0),
+        stats['max_bytes'] / (1024.0 * 1024.0))
+
+
+def run_replay(path, realtime=False):
+    # Plays back a recording made with --record. With realtime it's drawn in a window at the
+    # normal frame rate, otherwise it runs headless as fast as possible. Raises ReplayDesyncError
+    # as soon as the game's state stops matching one of the recorded checksums.
+    init_resources(headless=not realtime)
+    replay = InputReplayer(path)
+    game = replay.make_game(render=realtime)
+
+    start_time = time.perf_counter()
+    while not replay.done():
+        game.run_frame()
+        if realtime:
+            FPSCLOCK.tick(FPS)
+    total_time = time.perf_counter() - start_time
+
+    return {
+        'frames': replay.frames,
+        'steps': game.step_count,
+        'seed': replay.seed,
+        'checksums_verified': replay.checksums_verified,
+        'seconds': total_time,
+        'fps': replay.frames / total_time if total_time else 0.0,
+        'checksum': game.state_checksum()}
+
 
-    # load the image files
-    R_DRAGON_IMG = pygame.image.load('./images/blueberry-dragon.png')
-    L_DRAGON_IMG = pygame.transform.flip(R_DRAGON_IMG, True, False)
+def _has_window_shape(size):
+    # True if size has the window's aspect ratio, give or take a pixel of rounding
+    width, height = size
+    return width > 0 and abs(width * WINHEIGHT / float(WINWIDTH) - height) < 1
 
-    GRASSIMAGES = []
-    for i in range(1, 4):
-        GRASSIMAGES.append(pygame.image.load('./images/rock%s.png' % i))
 
-    game = BDGame()
+def _parse_size(text):
+    import argparse
+    width, height = text.split('x')
+    size = int(width), int(height)
+    if not _has_window_shape(size):
+        raise argparse.ArgumentTypeError('%s is not the same shape as the %sx%s window' % (text, WINWIDTH, WINHEIGHT))
+    return size
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Blueberry Dragon Eat Blueberry Dragon')
+    parser.add_argument('--benchmark', type=int, metavar='FRAMES',
+                        help='play FRAMES frames headless with scripted input and report frames/sec')
+    parser.add_argument('--seed', type=int, default=0, help='RNG seed for the benchmarks')
+    parser.add_argument('--no-render', action='store_true', help='skip drawing entirely during --benchmark')
+    parser.add_argument('--backend', choices=('objects', 'numpy'), default=DRAGONBACKEND,
+                        help='how enemy dragons are stored')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='time every stage of every frame (F3 shows the timings) and save them '
+                             'to PATH (.csv or .json) on exit')
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help='only redraw and update the parts of the screen that changed')
+    parser.add_argument('--record', metavar='PATH',
+                        help='save the seed and every frame\'s input to PATH so the game can be replayed')
+    parser.add_argument('--replay', metavar='PATH',
+                        help='play back a recording headless as fast as possible, checking it doesn\'t diverge')
+    parser.add_argument('--realtime', action='store_true', help='draw --replay in a window at normal speed')
+    parser.add_argument('--render-size', type=_parse_size, metavar='WxH',
+                        help='draw the game at WxH and scale it to the window, e.g. 320x240 on slow machines')
+    parser.add_argument('--ecosystem', action='store_true', help='enemy dragons eat the smaller dragons they run into')
+    parser.add_argument('--alloc-profile', metavar='PATH',
+                        help='also count the allocations and garbage collections of every stage, and save '
+                             'the stage timings to PATH and the allocations to PATH minus its extension + .alloc.json')
+    parser.add_argument('--gc', choices=('freeze', 'defer'), default=GCMODE,
+                        help='freeze the objects made before play starts, or only collect garbage between frames')
+    args = parser.parse_args()
+    config = {'ECOSYSTEM': True} if args.ecosystem else None
+
+    if args.replay:
+        try:
+            results = run_replay(args.replay, args.realtime)
+        except ReplayDesyncError as e:
+            sys.exit(str(e))
+        for key, value in results.items():
+            print('%-18s %s' % (key, round(value, 3) if isinstance(value, float) else value))
+        return
+
+    if args.benchmark:
+        results = run_benchmark(args.benchmark, args.seed, not args.no_render, args.backend, args.profile,
+                                args.dirty_rects, args.record, args.render_size, config, args.alloc_profile, args.gc)
+        for key, value in results.items():
+            print('%-15s %s' % (key, round(value, 3) if isinstance(value, float) else value))
+        return
+
+    init_resources()
+
+    if args.alloc_profile:
+        profiler = AllocationProfiler(dump_path=args.alloc_profile)
+    else:
+        profiler = FrameProfiler(dump_path=args.profile) if args.profile else None
+    game = BDGame(dragon_backend=args.backend, profiler=profiler, dirty_rects=args.dirty_rects,
+                  render_size=args.render_size, config=config, gc_mode=args.gc)
+    if args.record:
+        game.recorder = InputRecorder(args.record, game)
 
     while True:
         game.run_game()
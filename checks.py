@@ -0,0 +1,202 @@
+# Brute force cross-checks of the shortcuts Blueberry Dragon takes to stay fast. Each
+# check works out the slow, obvious answer and compares it with what the game does,
+# and the script exits with an error if any of them disagree:
+#
+#   python checks.py
+
+import argparse
+import os
+import sys
+import tempfile
+import zlib
+
+import pygame
+
+import blueberry_dragon as bd
+
+
+class _CountingRandom:
+    """Stands in for a game's random.Random, handing out 0, 1, 2, ... from randrange()
+    so every spot in a spawn ring gets picked exactly once."""
+
+    def __init__(self):
+        self.next = 0
+
+    def randrange(self, stop):
+        value = self.next
+        self.next += 1
+        if value >= stop:
+            raise AssertionError('asked for a number below %s after %s of them' % (stop, value))
+        return value
+
+
+def check_spawn_rings():
+    # Every corner BDGame._get_random_off_camera_positions can pick should be one the
+    # old rejection loop could pick (in the active area, with the object entirely out
+    # of the camera view), every one of those should be picked, and each exactly once
+    # as the ring's spots are counted through, so they're all equally likely. Small
+    # views keep the brute force quick.
+    game = bd.BDGame(seed=0, render=False, spawn_workers=0)
+    game.spawn_queue.close()
+    failures = []
+    for view_width, view_height in ((12, 9), (7, 13), (1, 1)):
+        for camera_x, camera_y in ((0, 0), (5, -7), (-40, 23)):
+            for obj_width, obj_height in ((3, 2), (1, 1), (view_width, view_height), (7, 8), (20, 1)):
+                allowed = set()
+                for x in range(camera_x - view_width, camera_x + 2 * view_width + 1):
+                    for y in range(camera_y - view_height, camera_y + 2 * view_height + 1):
+                        if not (x < camera_x + view_width and x + obj_width > camera_x and
+                                y < camera_y + view_height and y + obj_height > camera_y):
+                            allowed.add((x, y))
+
+                game.view_width, game.view_height = view_width, view_height
+                game.random = _CountingRandom()
+                total = bd.SPAWNRINGS[obj_width, obj_height, view_width, view_height][0]
+                picked = game._get_random_off_camera_positions(camera_x, camera_y,
+                                                               [(obj_width, obj_height)] * total)
+                if len(set(picked)) != len(picked) or set(picked) != allowed:
+                    failures.append('view %sx%s, camera at %s,%s, object %sx%s: %s corners picked, %s different, '
+                                    '%s allowed' % (view_width, view_height, camera_x, camera_y, obj_width,
+                                                    obj_height, len(picked), len(set(picked)), len(allowed)))
+    return failures
+
+
+def _get_all_pairs(dragons):
+    # every two dragons that overlap, found by checking each pair, as sets of ids
+    dragons = list(dragons)
+    pairs = set()
+    for i, d_obj in enumerate(dragons):
+        for other in dragons[i + 1:]:
+            if (other.x < d_obj.x + d_obj.width and other.x + other.width > d_obj.x and
+                    other.y < d_obj.y + d_obj.height and other.y + other.height > d_obj.y):
+                pairs.add(frozenset((id(d_obj), id(other))))
+    return pairs
+
+
+def check_sweep_and_prune():
+    # After every step of an ECOSYSTEM game, with dragons moving, spawning, despawning and
+    # being eaten, the sweep and prune of each backend should find exactly the pairs that
+    # checking every pair does. The player heads off diagonally to keep dragons despawning.
+    backends = ('objects', 'numpy') if bd.has_numpy() else ('objects',)
+    failures = []
+    for backend in backends:
+        game = bd.BDGame(dragon_backend=backend, seed=3, render=False, spawn_workers=0,
+                         config={'ECOSYSTEM': True, 'NUM_DRAGONS': 300})
+        game.set_input(False, True, False, True)
+        for step in range(300):
+            game.run_frame()
+            if game.dragon_sweep is not None:
+                pairs = game.dragon_sweep.get_pairs()
+                swept = len(game.dragon_sweep.objs)
+            else:
+                pairs = game.dragon_objs.get_overlapping_pairs()
+                swept = len(game.dragon_objs.sweep_refs)
+            found = {frozenset((id(d_obj), id(other))) for d_obj, other in pairs}
+            expected = _get_all_pairs(game.dragon_objs)
+            if found != expected or swept != len(game.dragon_objs):
+                failures.append('%s backend, step %s: %s pairs found, %s missed, %s wrong, %s of %s dragons swept' % (
+                    backend, step, len(found), len(expected - found), len(found - expected), swept,
+                    len(game.dragon_objs)))
+                break
+        if not game.dragon_meals:
+            failures.append('%s backend: no dragon got eaten, so nothing was checked' % backend)
+    return failures
+
+
+def _get_frame_checksums(frames, **options):
+    # Plays a game standing still for the first half of the frames and heading up and
+    # to the left for the rest, and returns a CRC of the window after every frame
+    game = bd.BDGame(seed=5, spawn_workers=0, **options)
+    checksums = []
+    for frame in range(frames):
+        if frame == frames // 2:
+            game.set_input(True, False, True, False)
+        game.run_frame()
+        checksums.append(zlib.crc32(pygame.image.tostring(bd.DISPLAYSURF, 'RGB')))
+    game.spawn_queue.close()
+    return checksums
+
+
+def check_dirty_rects():
+    # Redrawing only the parts of the screen that changed should leave exactly the
+    # pixels a full redraw does, every frame, with the camera still and scrolling. The
+    # games take turns with the one window, so each plays all its frames in one go.
+    failures = []
+    for render_size in ((bd.WINWIDTH, bd.WINHEIGHT), (bd.WINWIDTH // 2, bd.WINHEIGHT // 2)):
+        full = _get_frame_checksums(80, render_size=render_size)
+        dirty = _get_frame_checksums(80, render_size=render_size, dirty_rects=True)
+        for frame, (full_checksum, dirty_checksum) in enumerate(zip(full, dirty)):
+            if full_checksum != dirty_checksum:
+                failures.append('render size %sx%s: frame %s differs from a full redraw' % (render_size + (frame,)))
+                break
+    return failures
+
+
+def check_replay():
+    # A game recorded with --record and played back with --replay should pass every
+    # checksum written along the way and end up in the same state, on both backends.
+    # Recording draws the frames and the replay doesn't, so it covers that too.
+    backends = ('objects', 'numpy') if bd.has_numpy() else ('objects',)
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in backends:
+            path = os.path.join(directory, backend + '.bdr')
+            recorded = bd.run_benchmark(400, seed=9, dragon_backend=backend, record_path=path)
+            try:
+                replayed = bd.run_replay(path)
+            except bd.ReplayDesyncError as e:
+                failures.append('%s backend: %s' % (backend, e))
+                continue
+            if replayed['checksum'] != recorded['checksum'] or not replayed['checksums_verified']:
+                failures.append('%s backend: replay ended with checksum %s, recorded %s, %s checksums verified' % (
+                    backend, replayed['checksum'], recorded['checksum'], replayed['checksums_verified']))
+    return failures
+
+
+def check_no_render():
+    # Skipping the drawing with --no-render should leave the game playing out exactly
+    # the same, for each backend, with and without dragons eating each other.
+    backends = ('objects', 'numpy') if bd.has_numpy() else ('objects',)
+    failures = []
+    for backend in backends:
+        for config in (None, {'ECOSYSTEM': True, 'NUM_DRAGONS': 300}):
+            drawn = bd.run_benchmark(400, seed=11, dragon_backend=backend, config=config)
+            headless = bd.run_benchmark(400, seed=11, dragon_backend=backend, config=config, render=False)
+            if drawn['checksum'] != headless['checksum']:
+                failures.append('%s backend, config %s: checksum %s without drawing, %s with' % (
+                    backend, config, headless['checksum'], drawn['checksum']))
+    return failures
+
+
+CHECKS = {
+    'dirty_rects': check_dirty_rects,
+    'no_render': check_no_render,
+    'replay': check_replay,
+    'spawn_rings': check_spawn_rings,
+    'sweep_and_prune': check_sweep_and_prune}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the game\'s shortcuts against brute force')
+    parser.add_argument('checks', nargs='*', metavar='CHECK',
+                        help='which checks to run, out of %s (default: all)' % ', '.join(sorted(CHECKS)))
+    args = parser.parse_args()
+    for name in args.checks:
+        if name not in CHECKS:
+            parser.error('there is no check called %r' % name)
+
+    bd.init_resources(headless=True)
+    failed = False
+    for name in args.checks or sorted(CHECKS):
+        failures = CHECKS[name]()
+        print('%-16s %s' % (name, 'FAILED' if failures else 'ok'))
+        for failure in failures:
+            print('    ' + failure)
+        failed = failed or bool(failures)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()